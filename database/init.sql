@@ -4,5 +4,87 @@ CREATE TABLE IF NOT EXISTS predictions (
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     predicted_digit INTEGER,
     true_label INTEGER,
-    confidence FLOAT
-);
\ No newline at end of file
+    confidence FLOAT,
+    -- Preprocessed input image as raw uint8 pixels, 784 bytes for 28x28, when the client sent it
+    image BYTEA
+);
+
+-- Added for fine-tuning from logged predictions. Safe to re-run against an existing database
+ALTER TABLE predictions ADD COLUMN IF NOT EXISTS image BYTEA;
+
+-- Indexes for newest-first keyset pagination of prediction history, optionally filtered by digit.
+-- Safe to re-run against an existing database to add them.
+CREATE INDEX IF NOT EXISTS predictions_timestamp_id_idx
+    ON predictions (timestamp, id);
+CREATE INDEX IF NOT EXISTS predictions_predicted_digit_timestamp_id_idx
+    ON predictions (predicted_digit, timestamp, id);
+CREATE INDEX IF NOT EXISTS predictions_true_label_timestamp_id_idx
+    ON predictions (true_label, timestamp, id);
+
+-- Incrementally maintained accuracy analytics, one row per cell per hourly bucket:
+-- a 10x10 confusion matrix and confidence histograms (10 bins) for correct and incorrect predictions
+CREATE TABLE IF NOT EXISTS prediction_confusion_counts (
+    bucket_start TIMESTAMP NOT NULL,
+    true_label INTEGER NOT NULL,
+    predicted_digit INTEGER NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (bucket_start, true_label, predicted_digit)
+);
+
+CREATE TABLE IF NOT EXISTS prediction_confidence_histogram (
+    bucket_start TIMESTAMP NOT NULL,
+    correct BOOLEAN NOT NULL,
+    bin INTEGER NOT NULL,
+    count BIGINT NOT NULL,
+    PRIMARY KEY (bucket_start, correct, bin)
+);
+
+-- Fold each INSERT statement's new rows into the summary tables with one upsert per table,
+-- so batched inserts update every touched cell once. Rows whose label or prediction is not a
+-- digit are left out of both tables, so the confusion matrix and histograms count the same rows
+CREATE OR REPLACE FUNCTION update_prediction_analytics() RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO prediction_confusion_counts (bucket_start, true_label, predicted_digit, count)
+    SELECT date_trunc('hour', timestamp), true_label, predicted_digit, COUNT(*)
+    FROM new_predictions
+    WHERE timestamp IS NOT NULL AND true_label BETWEEN 0 AND 9 AND predicted_digit BETWEEN 0 AND 9
+    GROUP BY 1, 2, 3
+    ON CONFLICT (bucket_start, true_label, predicted_digit)
+    DO UPDATE SET count = prediction_confusion_counts.count + EXCLUDED.count;
+
+    INSERT INTO prediction_confidence_histogram (bucket_start, correct, bin, count)
+    SELECT date_trunc('hour', timestamp), predicted_digit = true_label,
+           LEAST(GREATEST(FLOOR(confidence * 10)::INTEGER, 0), 9), COUNT(*)
+    FROM new_predictions
+    WHERE timestamp IS NOT NULL AND true_label BETWEEN 0 AND 9 AND predicted_digit BETWEEN 0 AND 9
+        AND confidence IS NOT NULL
+    GROUP BY 1, 2, 3
+    ON CONFLICT (bucket_start, correct, bin)
+    DO UPDATE SET count = prediction_confidence_histogram.count + EXCLUDED.count;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS predictions_analytics_trigger ON predictions;
+CREATE TRIGGER predictions_analytics_trigger
+    AFTER INSERT ON predictions
+    REFERENCING NEW TABLE AS new_predictions
+    FOR EACH STATEMENT EXECUTE FUNCTION update_prediction_analytics();
+
+-- Backfill the summaries from rows logged before the trigger existed
+INSERT INTO prediction_confusion_counts (bucket_start, true_label, predicted_digit, count)
+SELECT date_trunc('hour', timestamp), true_label, predicted_digit, COUNT(*)
+FROM predictions
+WHERE timestamp IS NOT NULL AND true_label BETWEEN 0 AND 9 AND predicted_digit BETWEEN 0 AND 9
+    AND NOT EXISTS (SELECT 1 FROM prediction_confusion_counts)
+GROUP BY 1, 2, 3;
+
+INSERT INTO prediction_confidence_histogram (bucket_start, correct, bin, count)
+SELECT date_trunc('hour', timestamp), predicted_digit = true_label,
+       LEAST(GREATEST(FLOOR(confidence * 10)::INTEGER, 0), 9), COUNT(*)
+FROM predictions
+WHERE timestamp IS NOT NULL AND true_label BETWEEN 0 AND 9 AND predicted_digit BETWEEN 0 AND 9
+    AND confidence IS NOT NULL
+    AND NOT EXISTS (SELECT 1 FROM prediction_confidence_histogram)
+GROUP BY 1, 2, 3;
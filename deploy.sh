@@ -85,6 +85,23 @@ for attempt in {1..10}; do
     fi
 done
 
+# Postgres only runs init.sql on an empty data volume, so apply it to existing databases too.
+# Every statement in it is safe to re-run
+echo -e "${BLUE}Applying database schema...${NC}"
+for attempt in {1..10}; do
+    if docker exec -i "${DB_CONTAINER_NAME}" psql -q -v ON_ERROR_STOP=1 -h localhost -U "${DB_USER}" -d "${DB_NAME}" \
+        < "${DB_DIR_NAME}/init.sql" > /dev/null 2>&1; then
+        echo -e "${GREEN}Database schema is up to date${NC}"
+        break
+    fi
+    echo -n "."
+    sleep 1
+    if [[ $attempt -eq 10 ]]; then
+        echo -e "${RED}Could not apply ${DB_DIR_NAME}/init.sql to the database${NC}"
+        exit 1
+    fi
+done
+
 # Check web server container health status
 echo -e "${BLUE}Checking web server container health status...${NC}"
 for attempt in {1..10}; do
@@ -0,0 +1,186 @@
+import torch
+import torch.optim as optim
+import psycopg2
+import argparse
+import datetime
+import json
+import os
+import sys
+
+from train import (
+    evaluate_model, export_inference_artifacts, load_datasets, load_environment_variables,
+    load_existing_model, load_tensor_datasets, save_model, setup_directories, train_step
+)
+
+
+# Load database connection settings, exiting if any is missing
+def load_db_config():
+    for var in DB_ENV_VARS:
+        DB_ENV_VARS[var] = os.getenv(var)
+        if DB_ENV_VARS[var] is None:
+            print(f"Error: Missing required environment variable: {var}")
+            sys.exit(1)
+    return {
+        'host': DB_ENV_VARS['DB_SERVICE_NAME'],
+        'port': int(DB_ENV_VARS['DB_PORT']),
+        'database': DB_ENV_VARS['DB_NAME'],
+        'user': DB_ENV_VARS['DB_USER'],
+        'password': DB_ENV_VARS['DB_PASSWORD'],
+        'timeout': int(DB_ENV_VARS['DB_TIMEOUT'])
+    }
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Fine-tune the current model on newly logged labelled drawings mixed with MNIST replay"
+    )
+    parser.add_argument('--batch-size', type=int, default=64, help="Logged images per optimizer step")
+    parser.add_argument('--replay-ratio', type=float, default=1.0,
+                        help="MNIST training images mixed into each step per logged image")
+    parser.add_argument('--learning-rate', type=float, default=0.001, help="SGD learning rate for fine-tuning")
+    parser.add_argument('--passes', type=int, default=1, help="Passes over the new logged images")
+    parser.add_argument('--min-rows', type=int, default=50, help="New labelled images needed to fine-tune at all")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for replay sampling")
+    return parser.parse_args()
+
+# Id of the last logged prediction already fine-tuned on, 0 before the first run
+def read_last_id(config):
+    path = config['paths']['fine_tune_state']
+    if not path.exists():
+        return 0
+    with open(path) as f:
+        return json.load(f)['last_id']
+
+def write_fine_tune_state(config, state):
+    path = config['paths']['fine_tune_state']
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    tmp_path.replace(path)
+
+# Count labelled predictions with an image logged after last_id, return (count, max_id)
+def count_new_rows(conn, last_id):
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT COUNT(*), MAX(id) FROM predictions "
+            "WHERE id > %s AND image IS NOT NULL AND true_label BETWEEN 0 AND 9",
+            (last_id,)
+        )
+        return cur.fetchone()
+
+# Stream labelled images with last_id < id <= max_id through a server-side cursor, so only one
+# batch is held at a time. Yields (images (B, H, W) uint8, labels (B,)) tensors
+def stream_labelled_batches(conn, last_id, max_id, batch_size, image_shape):
+    image_bytes = image_shape[0] * image_shape[1]
+    with conn.cursor(name='fine_tune_rows') as cur:
+        cur.itersize = batch_size
+        cur.execute(
+            "SELECT image, true_label FROM predictions "
+            "WHERE id > %s AND id <= %s AND image IS NOT NULL AND true_label BETWEEN 0 AND 9 ORDER BY id",
+            (last_id, max_id)
+        )
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            # Rows logged at another image size cannot be fed to the model
+            rows = [(image, label) for image, label in rows if len(image) == image_bytes]
+            if not rows:
+                continue
+            images = torch.frombuffer(bytearray(b''.join(image for image, _ in rows)), dtype=torch.uint8)
+            yield images.view(len(rows), *image_shape), torch.tensor([label for _, label in rows])
+    # Ends the read transaction, so the next pass sees a fresh snapshot
+    conn.rollback()
+
+# Fine-tune the current model on new labelled drawings, each batch mixed with a random sample
+# of MNIST training images so the model does not forget the original data. The weights are
+# only replaced when test set accuracy does not regress
+def main():
+    args = parse_args()
+    config = load_environment_variables()
+    db_config = load_db_config()
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    print(f"Using device: {device}")
+    setup_directories(config)
+
+    model = load_existing_model(config, device)
+    if model is None:
+        print("ERROR: No trained model to fine-tune, run train.py first")
+        sys.exit(1)
+
+    last_id = read_last_id(config)
+    try:
+        conn = psycopg2.connect(
+            host=db_config['host'],
+            port=db_config['port'],
+            database=db_config['database'],
+            user=db_config['user'],
+            password=db_config['password'],
+            connect_timeout=db_config['timeout']
+        )
+    except psycopg2.Error as e:
+        print(f"ERROR: Database connection error: {str(e)}")
+        sys.exit(1)
+
+    try:
+        new_rows, max_id = count_new_rows(conn, last_id)
+        if new_rows < args.min_rows:
+            print(f"Only {new_rows} new labelled images since prediction {last_id}, "
+                  f"{args.min_rows} needed - no fine-tuning needed")
+            sys.exit(0)
+
+        train_dataset, test_dataset = load_tensor_datasets(config)
+        _, test_loader = load_datasets(config, datasets=(train_dataset, test_dataset))
+        print("Evaluating current model...")
+        baseline_accuracy = evaluate_model(model, test_loader, device)
+
+        print(f"Fine-tuning on {new_rows} labelled images logged after prediction {last_id}...")
+        optimizer = optim.SGD(model.parameters(), lr=args.learning_rate, momentum=config['training']['momentum'])
+        generator = torch.Generator().manual_seed(args.seed)
+        image_shape = tuple(train_dataset.images.shape[1:])
+        model.train()
+        for current_pass in range(1, args.passes + 1):
+            seen = 0
+            for images, labels in stream_labelled_batches(conn, last_id, max_id, args.batch_size, image_shape):
+                replay = torch.randint(len(train_dataset), (round(len(labels) * args.replay_ratio),),
+                                       generator=generator)
+                replay_images, replay_labels = train_dataset[replay]
+                data = torch.cat([train_dataset.normalize(images), replay_images])
+                target = torch.cat([labels, replay_labels])
+                train_step(model, data, target, optimizer, device)
+                seen += len(labels)
+            print(f"Pass {current_pass}: trained on {seen} logged images")
+    finally:
+        conn.close()
+
+    print("Evaluating fine-tuned model...")
+    accuracy = evaluate_model(model, test_loader, device)
+    if accuracy < baseline_accuracy:
+        # The watermark stays put, so these rows are retried together with newer ones next time
+        print(f"Fine-tuned accuracy {accuracy:.2f}% is below the current {baseline_accuracy:.2f}%, "
+              f"keeping the current model")
+        sys.exit(0)
+
+    save_model(model, accuracy, config)
+    export_inference_artifacts(model, test_loader, config)
+    write_fine_tune_state(config, {
+        'last_id': max_id,
+        'rows': new_rows,
+        'accuracy': accuracy,
+        'baseline_accuracy': baseline_accuracy,
+        'timestamp': datetime.datetime.now().isoformat()
+    })
+    print(f"Fine-tuning state saved to {config['paths']['fine_tune_state']}")
+
+
+# Environment variables setup
+DB_ENV_VARS = {
+    'DB_SERVICE_NAME': None,
+    'DB_PORT': None,
+    'DB_NAME': None,
+    'DB_USER': None,
+    'DB_PASSWORD': None,
+    'DB_TIMEOUT': None,
+}
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+import torch
+import torch.multiprocessing as mp
+import torch.optim as optim
+import argparse
+import copy
+import datetime
+import itertools
+import json
+import math
+import os
+import random
+import statistics
+import time
+from pathlib import Path
+
+from train import (
+    MNISTModel, evaluate_model, export_inference_artifacts, load_datasets, load_environment_variables,
+    load_existing_model, load_tensor_datasets, save_model, setup_directories, train_epoch
+)
+
+
+# Training settings a sweep can vary, with the type each value is cast to
+SEARCH_PARAMETERS = {'batch_size': int, 'learning_rate': float, 'momentum': float}
+
+# Per-process state of trial workers, set up once by init_worker
+WORKER = {}
+
+
+# Parse "name=v1,v2,..." into a list of values, or "name=low:high" / "name=log:low:high"
+# into a uniform or log-uniform range for random search
+def parse_parameter(spec):
+    name, separator, values = spec.partition('=')
+    if not separator or name not in SEARCH_PARAMETERS:
+        raise argparse.ArgumentTypeError(f"Expected one of {', '.join(SEARCH_PARAMETERS)} as name=values, got {spec!r}")
+    try:
+        if ':' not in values:
+            return name, [SEARCH_PARAMETERS[name](value) for value in values.split(',')]
+        parts = values.split(':')
+        distribution = parts.pop(0) if parts[0] == 'log' else 'uniform'
+        low, high = (float(part) for part in parts)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Invalid values for {name}: {values!r}")
+    if not 0 < low < high if distribution == 'log' else not low < high:
+        raise argparse.ArgumentTypeError(f"Invalid {distribution} range for {name}: {values!r}")
+    return name, (distribution, low, high)
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Train several hyperparameter settings in parallel and promote the most accurate model"
+    )
+    parser.add_argument('--param', dest='params', action='append', type=parse_parameter, default=[],
+                        help="Search space entry: name=v1,v2 for values, name=low:high or name=log:low:high "
+                             f"for random search ranges. Names: {', '.join(SEARCH_PARAMETERS)}")
+    parser.add_argument('--search', choices=['grid', 'random'], default='grid',
+                        help="Try every combination of values, or sample --trials settings")
+    parser.add_argument('--trials', type=int, default=8, help="Settings sampled by random search")
+    parser.add_argument('--parallel', type=int, default=2, help="Trials trained at the same time")
+    parser.add_argument('--epochs', type=int, default=None, help="Epochs per trial, MODEL_EPOCHS if not given")
+    parser.add_argument('--prune-min-trials', type=int, default=2,
+                        help="Accuracies other trials must have reported for an epoch before pruning against them")
+    parser.add_argument('--prune-warmup-epochs', type=int, default=1, help="Epochs every trial trains before pruning")
+    parser.add_argument('--latency-iterations', type=int, default=100,
+                        help="Single-image forward passes timed for each trial's inference latency")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for random search and trial initialization")
+    parser.add_argument('--no-promote', action='store_true', help="Only report results, keep the current model")
+    parser.add_argument('--output', type=Path, default=Path('sweep_results.json'), help="Where to save results")
+    return parser.parse_args()
+
+def sample_parameter(rng, name, values):
+    if isinstance(values, list):
+        return rng.choice(values)
+    distribution, low, high = values
+    if distribution == 'log':
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return round(value) if SEARCH_PARAMETERS[name] is int else value
+
+# Expand the search space into the settings of each trial
+def build_trials(space, search, num_trials, seed):
+    if search == 'random':
+        rng = random.Random(seed)
+        return [{name: sample_parameter(rng, name, values) for name, values in space.items()}
+                for _ in range(num_trials)]
+    ranges = [name for name, values in space.items() if not isinstance(values, list)]
+    if ranges:
+        raise SystemExit(f"Grid search needs lists of values, got ranges for: {', '.join(ranges)}")
+    return [dict(zip(space, values)) for values in itertools.product(*space.values())]
+
+# Median pruning across concurrent trials: after the warmup epochs, a trial stops once its
+# accuracy is below the median that other trials reached after the same epoch
+class MedianPruner:
+    def __init__(self, manager, min_trials, warmup_epochs):
+        self.history = manager.dict()
+        self.lock = manager.Lock()
+        self.min_trials = min_trials
+        self.warmup_epochs = warmup_epochs
+
+    # Record a trial's accuracy after an epoch, return whether the trial should stop
+    def report(self, epoch, accuracy):
+        with self.lock:
+            others = self.history.get(epoch, [])
+            self.history[epoch] = others + [accuracy]
+        if epoch <= self.warmup_epochs or len(others) < self.min_trials:
+            return False
+        return accuracy < statistics.median(others)
+
+def init_worker(config, datasets, pruner, threads):
+    torch.set_num_threads(threads)
+    WORKER['config'] = config
+    WORKER['datasets'] = datasets
+    WORKER['pruner'] = pruner
+
+# Median wall time of a single-image forward pass, in milliseconds
+def measure_inference_latency(model, test_loader, iterations):
+    model.eval()
+    image, _ = test_loader.dataset[[0]]
+    latencies = []
+    with torch.no_grad():
+        model(image)
+        for _ in range(iterations):
+            start = time.perf_counter()
+            model(image)
+            latencies.append(time.perf_counter() - start)
+    return 1000 * statistics.median(latencies)
+
+# Train one setting on CPU, return its results with the weights of its most accurate epoch
+def run_trial(task):
+    trial, params, seed, latency_iterations = task
+    config = copy.deepcopy(WORKER['config'])
+    config['training'].update(params)
+    device = torch.device("cpu")
+
+    start = time.perf_counter()
+    torch.manual_seed(seed)
+    model = MNISTModel().to(device)
+    optimizer = optim.SGD(
+        model.parameters(),
+        lr=config['training']['learning_rate'],
+        momentum=config['training']['momentum']
+    )
+    train_loader, test_loader = load_datasets(config, datasets=WORKER['datasets'])
+    patience = config['training']['early_stopping_patience']
+
+    best_accuracy = 0.0
+    best_state = None
+    epochs_without_improvement = 0
+    status = 'completed'
+    for epoch in range(1, config['training']['epochs'] + 1):
+        train_epoch(model, train_loader, optimizer, device, epoch, log_progress=False)
+        accuracy = evaluate_model(model, test_loader, device, log_results=False)
+        print(f"Trial {trial} epoch {epoch}: accuracy {accuracy:.2f}%")
+        if best_state is None or accuracy > best_accuracy:
+            best_accuracy = accuracy
+            best_state = copy.deepcopy(model.state_dict())
+            epochs_without_improvement = 0
+        else:
+            epochs_without_improvement += 1
+
+        if WORKER['pruner'].report(epoch, accuracy):
+            status = 'pruned'
+            break
+        if 0 < patience <= epochs_without_improvement:
+            status = 'stopped early'
+            break
+    wall_time = time.perf_counter() - start
+
+    model.load_state_dict(best_state)
+    return {
+        'trial': trial,
+        **params,
+        'accuracy': best_accuracy,
+        'epochs': epoch,
+        'status': status,
+        'wall_time_s': wall_time,
+        'latency_ms': measure_inference_latency(model, test_loader, latency_iterations),
+        'state_dict': best_state
+    }
+
+def print_results(results, names):
+    columns = ['trial', *names, 'accuracy', 'epochs', 'status', 'wall_time_s', 'latency_ms']
+    print('\n' + ' '.join(f"{column:>14}" for column in columns))
+    for result in results:
+        print(' '.join(f"{result[column]:>14.4g}" if isinstance(result[column], float) else f"{result[column]:>14}"
+                       for column in columns))
+
+# Save the best trial's weights as the served model, unless the current model is at least as accurate
+def promote_model(best, config, datasets):
+    device = torch.device("cpu")
+    _, test_loader = load_datasets(config, datasets=datasets)
+    current = load_existing_model(config, device)
+    if current is not None:
+        current_accuracy = evaluate_model(current, test_loader, device)
+        if current_accuracy >= best['accuracy']:
+            print(f"Keeping the current model: its accuracy {current_accuracy:.2f}% is not below "
+                  f"trial {best['trial']}'s {best['accuracy']:.2f}%")
+            return
+
+    print(f"Promoting trial {best['trial']}")
+    model = MNISTModel().to(device)
+    model.load_state_dict(best['state_dict'])
+    save_model(model, best['accuracy'], config)
+    export_inference_artifacts(model, test_loader, config)
+
+def main():
+    args = parse_args()
+    config = load_environment_variables()
+    setup_directories(config)
+    if args.epochs is not None:
+        config['training']['epochs'] = args.epochs
+    # Batches are slices of in-memory tensors, so loader processes would only compete with
+    # the trials for cores
+    config['training']['loader_workers'] = 0
+
+    space = dict(args.params)
+    trials = build_trials(space, args.search, args.trials, args.seed)
+    parallel = max(1, min(args.parallel, len(trials)))
+    # Split the cores between trials so their intra-op thread pools don't oversubscribe
+    threads = max(1, (os.cpu_count() or 1) // parallel)
+    print(f"Running {len(trials)} trials, {parallel} at a time with {threads} threads each")
+
+    # Loaded once into shared memory; workers receive handles to it rather than copies
+    datasets = tuple(dataset.share_memory_() for dataset in load_tensor_datasets(config))
+    tasks = [(trial, params, args.seed + trial, args.latency_iterations) for trial, params in enumerate(trials)]
+
+    context = mp.get_context('spawn')
+    results = []
+    best = None
+    with context.Manager() as manager:
+        pruner = MedianPruner(manager, args.prune_min_trials, args.prune_warmup_epochs)
+        with context.Pool(parallel, initializer=init_worker, initargs=(config, datasets, pruner, threads)) as pool:
+            for result in pool.imap_unordered(run_trial, tasks):
+                state_dict = result.pop('state_dict')
+                results.append(result)
+                print(f"Trial {result['trial']} {result['status']} after {result['epochs']} epochs: "
+                      f"accuracy {result['accuracy']:.2f}% in {result['wall_time_s']:.1f}s")
+                # Only the best weights so far are kept
+                if best is None or result['accuracy'] > best['accuracy']:
+                    best = {**result, 'state_dict': state_dict}
+
+    results.sort(key=lambda result: result['accuracy'], reverse=True)
+    print_results(results, list(space))
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'torch': torch.__version__,
+            'cpu_count': os.cpu_count(),
+            'training_config': config['training'],
+            'args': {name: str(value) if isinstance(value, Path) else value for name, value in vars(args).items()}
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if best is not None and not args.no_promote:
+        promote_model(best, config, datasets)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,16 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader
-from torchvision import datasets, transforms
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import BatchSampler, DataLoader, Dataset, DistributedSampler, RandomSampler, SequentialSampler
+from torchvision import datasets
 import os
 import sys
+import json
+import time
+import socket
 from pathlib import Path
 
 
@@ -17,6 +23,7 @@ def load_environment_variables():
             sys.exit(1)
     
     model_dir = Path(f"/{ENV_VARS['CONTAINER_WORKDIR_NAME']}/{ENV_VARS['TRAINED_MODEL_DIR_NAME']}")
+    model_stem = Path(ENV_VARS['TRAINED_MODEL_NAME']).stem
     config = {
         'dataset': {
             'mean': float(ENV_VARS['MNIST_DATASET_MEAN']),
@@ -26,12 +33,23 @@ def load_environment_variables():
             'batch_size': int(ENV_VARS['MODEL_BATCH_SIZE']),
             'epochs': int(ENV_VARS['MODEL_EPOCHS']),
             'learning_rate': float(ENV_VARS['MODEL_LEARNING_RATE']),
-            'momentum': float(ENV_VARS['MODEL_MOMENTUM'])
+            'momentum': float(ENV_VARS['MODEL_MOMENTUM']),
+            'loader_workers': int(ENV_VARS['MODEL_LOADER_WORKERS']),
+            'pin_memory': ENV_VARS['MODEL_PIN_MEMORY'].lower() == 'true',
+            'processes': int(ENV_VARS['MODEL_TRAINING_PROCESSES']),
+            'baseline_batches': int(ENV_VARS['MODEL_SCALING_BASELINE_BATCHES']),
+            'resume': ENV_VARS['MODEL_RESUME'].lower() == 'true',
+            'early_stopping_patience': int(ENV_VARS['MODEL_EARLY_STOPPING_PATIENCE'])
         },
         'paths': {
             'dataset': Path(f"/{ENV_VARS['CONTAINER_WORKDIR_NAME']}/{ENV_VARS['DATASET_DIR_NAME']}"),
             'model_weights': model_dir / ENV_VARS['TRAINED_MODEL_NAME'],
-            'model_file': model_dir / ENV_VARS['MODEL_FILE_NAME']
+            'model_file': model_dir / ENV_VARS['MODEL_FILE_NAME'],
+            'scripted_model': model_dir / f"{model_stem}_scripted.pt",
+            'quantized_model': model_dir / f"{model_stem}_quantized.pt",
+            'artifacts_manifest': model_dir / f"{model_stem}_artifacts.json",
+            'checkpoint': model_dir / f"{model_stem}_checkpoint.pt",
+            'fine_tune_state': model_dir / f"{model_stem}_fine_tune.json"
         }
     }
     return config
@@ -41,39 +59,110 @@ def setup_directories(config):
     config['paths']['dataset'].parent.mkdir(parents=True, exist_ok=True)
     config['paths']['model_weights'].parent.mkdir(parents=True, exist_ok=True)
 
-# Load and prepare MNIST datasets
-def load_datasets(config):
-    transform = transforms.Compose([
-        transforms.ToTensor(),
-        transforms.Normalize((config['dataset']['mean'],), (config['dataset']['std'],))
-    ])
-    
-    train_dataset = datasets.MNIST(config['paths']['dataset'], train=True, download=True, transform=transform)
-    test_dataset = datasets.MNIST(config['paths']['dataset'], train=False, download=True, transform=transform)
+# MNIST split held as one uint8 image tensor, indexed and normalized a whole batch at a time
+class MNISTTensorDataset(Dataset):
+    def __init__(self, path, mean, std):
+        # Memory-mapped, so loader workers share the pages instead of copying the dataset
+        tensors = torch.load(path, mmap=True)
+        self.images = tensors['images']
+        self.labels = tensors['labels']
+        self.mean = mean
+        self.std = std
+
+    # Copy the split into shared memory, so processes it is passed to all index this one copy
+    def share_memory_(self):
+        self.images = self.images.clone().share_memory_()
+        self.labels = self.labels.clone().share_memory_()
+        return self
+
+    def __len__(self):
+        return len(self.labels)
+
+    # Convert uint8 images (B, 28, 28) to normalized model inputs (B, 1, 28, 28)
+    def normalize(self, images):
+        return images.unsqueeze(1).float().div_(255).sub_(self.mean).div_(self.std)
+
+    # Takes a list of indices from a BatchSampler, returns (images (B, 1, 28, 28), labels (B,))
+    def __getitem__(self, indices):
+        indices = torch.as_tensor(indices)
+        return self.normalize(self.images[indices]), self.labels[indices]
+
+# Convert an MNIST split to a uint8 tensor file once, return its path
+def prepare_tensor_dataset(config, train):
+    split = 'train' if train else 'test'
+    path = config['paths']['dataset'] / f"mnist_{split}_uint8.pt"
+    if not path.exists():
+        print(f"Converting MNIST {split} split to {path}...")
+        mnist = datasets.MNIST(config['paths']['dataset'], train=train, download=True)
+        tmp_path = path.with_suffix('.tmp')
+        torch.save({'images': mnist.data.contiguous(), 'labels': mnist.targets.contiguous()}, tmp_path)
+        tmp_path.replace(path)
+    return path
+
+# Load the MNIST train and test splits, return (train_dataset, test_dataset)
+def load_tensor_datasets(config):
+    return tuple(
+        MNISTTensorDataset(prepare_tensor_dataset(config, train), config['dataset']['mean'], config['dataset']['std'])
+        for train in (True, False)
+    )
+
+# Load and prepare MNIST data loaders, over already loaded (train, test) datasets if given.
+# With world_size > 1 the training set is sharded across ranks and MODEL_BATCH_SIZE stays
+# the global batch size, split evenly between them
+def load_datasets(config, rank=0, world_size=1, datasets=None):
+    train_dataset, test_dataset = datasets if datasets is not None else load_tensor_datasets(config)
     
-    train_loader = DataLoader(train_dataset, batch_size=config['training']['batch_size'], shuffle=True)
-    test_loader = DataLoader(test_dataset, batch_size=config['training']['batch_size'], shuffle=False)
+    batch_size = config['training']['batch_size']
+    train_batch_size = max(1, batch_size // world_size)
+    if world_size > 1:
+        train_sampler = DistributedSampler(train_dataset, num_replicas=world_size, rank=rank, shuffle=True)
+    else:
+        train_sampler = RandomSampler(train_dataset)
+    workers = config['training']['loader_workers']
+    loader_options = {
+        'batch_size': None,
+        'num_workers': workers,
+        'pin_memory': config['training']['pin_memory'],
+        'persistent_workers': workers > 0,
+    }
+    train_loader = DataLoader(
+        train_dataset,
+        sampler=BatchSampler(train_sampler, train_batch_size, drop_last=False),
+        **loader_options
+    )
+    test_loader = DataLoader(
+        test_dataset,
+        sampler=BatchSampler(SequentialSampler(test_dataset), batch_size, drop_last=False),
+        **loader_options
+    )
     
     return train_loader, test_loader
 
+# Run one optimizer step on a batch, return the loss
+def train_step(model, data, target, optimizer, device):
+    data, target = data.to(device), target.to(device)
+    optimizer.zero_grad()
+    output = model(data)
+    loss = nn.CrossEntropyLoss()(output, target)
+    loss.backward()
+    optimizer.step()
+    return loss
+
 # Train the model for one epoch
-def train_epoch(model, train_loader, optimizer, device, current_epoch):
+def train_epoch(model, train_loader, optimizer, device, current_epoch, log_progress=True):
     model.train()
+    # The BatchSampler wraps a per-rank sampler, so this is the shard size in distributed mode
+    num_samples = len(train_loader.sampler.sampler)
     for batch_idx, (data, target) in enumerate(train_loader):
-        data, target = data.to(device), target.to(device)
-        optimizer.zero_grad()
-        output = model(data)
-        loss = nn.CrossEntropyLoss()(output, target)
-        loss.backward()
-        optimizer.step()
+        loss = train_step(model, data, target, optimizer, device)
         
-        if batch_idx % 100 == 0:
+        if log_progress and batch_idx % 100 == 0:
             progress = 100. * batch_idx / len(train_loader)
-            print(f'Epoch {current_epoch}: {batch_idx * len(data)}/{len(train_loader.dataset)} '
+            print(f'Epoch {current_epoch}: {batch_idx * len(data)}/{num_samples} '
                   f'({progress:.0f}%) Loss: {loss.item():.6f}')
 
 # Evaluate the model on the test dataset
-def evaluate_model(model, test_loader, device):
+def evaluate_model(model, test_loader, device, log_results=True):
     model.eval()
     test_loss = 0
     correct = 0
@@ -87,7 +176,8 @@ def evaluate_model(model, test_loader, device):
 
     test_loss /= len(test_loader.dataset)
     accuracy = 100. * correct / len(test_loader.dataset)
-    print(f'Test set: Loss: {test_loss:.4f}, Accuracy: {correct}/{len(test_loader.dataset)} ({accuracy:.2f}%)')
+    if log_results:
+        print(f'Test set: Loss: {test_loss:.4f}, Accuracy: {correct}/{len(test_loader.dataset)} ({accuracy:.2f}%)')
     return accuracy
 
 # Save both model weights and model definition file
@@ -95,7 +185,10 @@ def save_model(model, accuracy, config):
     model_dir = config['paths']['model_weights'].parent
     model_dir.mkdir(parents=True, exist_ok=True)
 
-    torch.save(model.state_dict(), config['paths']['model_weights'])
+    # Written to a temporary file and renamed, so a running webserver never loads half-written weights
+    tmp_path = config['paths']['model_weights'].with_suffix('.tmp')
+    torch.save(model.state_dict(), tmp_path)
+    tmp_path.replace(config['paths']['model_weights'])
     print(f"Model weights saved to {config['paths']['model_weights']} with accuracy: {accuracy:.2f}%")
     
     try:
@@ -108,6 +201,52 @@ def save_model(model, accuracy, config):
         print(f"ERROR: Could not copy model definition file: {e}")
         sys.exit(1)
 
+# Export TorchScript and dynamically int8-quantized inference artifacts next to the weights,
+# recording each one's test set accuracy relative to the float32 model
+def export_inference_artifacts(model, test_loader, config):
+    print("Exporting inference artifacts...")
+    cpu = torch.device("cpu")
+    model = model.to(cpu).eval()
+    baseline_accuracy = evaluate_model(model, test_loader, cpu)
+    
+    artifacts = {
+        'scripted': (
+            torch.jit.freeze(torch.jit.script(model)),
+            config['paths']['scripted_model']
+        ),
+        # fc1 (9216x128) holds almost all parameters, so quantizing the linear layers shrinks the model ~4x
+        'quantized': (
+            torch.jit.script(torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)),
+            config['paths']['quantized_model']
+        ),
+    }
+    manifest = {
+        'float32': {
+            'file': config['paths']['model_weights'].name,
+            'accuracy': baseline_accuracy,
+            'accuracy_delta': 0.0
+        }
+    }
+    for variant, (artifact, path) in artifacts.items():
+        tmp_path = path.with_suffix('.tmp')
+        torch.jit.save(artifact, tmp_path)
+        tmp_path.replace(path)
+        accuracy = evaluate_model(artifact, test_loader, cpu)
+        manifest[variant] = {
+            'file': path.name,
+            'accuracy': accuracy,
+            'accuracy_delta': accuracy - baseline_accuracy
+        }
+        print(f"Saved {variant} model to {path}: accuracy {accuracy:.2f}% ({accuracy - baseline_accuracy:+.2f})")
+    
+    with open(config['paths']['artifacts_manifest'], 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Artifacts manifest saved to {config['paths']['artifacts_manifest']}\n")
+
+# Check that all inference artifacts have been exported
+def inference_artifacts_exist(config):
+    return all(config['paths'][name].exists() for name in ('scripted_model', 'quantized_model', 'artifacts_manifest'))
+
 # Try to load existing trained model using saved model definition
 def load_existing_model(config, device):
     model_dir = config['paths']['model_weights'].parent
@@ -141,33 +280,174 @@ def load_existing_model(config, device):
         if str(model_dir) in sys.path:
             sys.path.remove(str(model_dir))
 
-# Train a new model from scratch
-def train_model(config, device):
-    print("Initializing new model for training...")
+# Measure single-process training throughput (samples/s) over the first batches of an epoch,
+# as the reference for distributed scaling efficiency
+def measure_training_throughput(config, device):
     model = MNISTModel().to(device)
+    model.train()
+    train_loader, _ = load_datasets(config)
+    optimizer = optim.SGD(
+        model.parameters(),
+        lr=config['training']['learning_rate'],
+        momentum=config['training']['momentum']
+    )
+    
+    samples = 0
+    batches = iter(train_loader)
+    train_step(model, *next(batches), optimizer, device)
+    start = time.perf_counter()
+    for _, (data, target) in zip(range(config['training']['baseline_batches']), batches):
+        train_step(model, data, target, optimizer, device)
+        samples += len(data)
+    return samples / (time.perf_counter() - start)
+
+# Pick a free local port for the process group rendezvous
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# Train a new model from scratch, in MODEL_TRAINING_PROCESSES data-parallel processes when above 1
+def train_model(config, device):
+    world_size = config['training']['processes']
+    if world_size == 1:
+        run_training(0, 1, config, device, None, None)
+        return
+    
+    # gloo all-reduces CPU tensors, so distributed training always runs on CPU
+    cpu = torch.device("cpu")
+    print("Measuring single-process throughput for scaling comparison...")
+    baseline_throughput = measure_training_throughput(config, cpu)
+    print(f"Single-process throughput: {baseline_throughput:.0f} samples/s")
+    
+    print(f"Starting {world_size} training processes...")
+    mp.spawn(
+        run_training,
+        args=(world_size, config, cpu, find_free_port(), baseline_throughput),
+        nprocs=world_size,
+        join=True
+    )
+
+# Write a full training checkpoint atomically, so an interrupted save never leaves a truncated file
+def save_checkpoint(model, optimizer, epoch, best_accuracy, epochs_without_improvement, stopped_early, config):
+    path = config['paths']['checkpoint']
+    tmp_path = path.with_suffix('.tmp')
+    torch.save({
+        'model': model.state_dict(),
+        'optimizer': optimizer.state_dict(),
+        'epoch': epoch,
+        'best_accuracy': best_accuracy,
+        'epochs_without_improvement': epochs_without_improvement,
+        'stopped_early': stopped_early,
+        'rng_state': torch.get_rng_state(),
+    }, tmp_path)
+    tmp_path.replace(path)
+
+# Load the last checkpoint if resuming is enabled and that run still has epochs left
+def load_resumable_checkpoint(config, device):
+    path = config['paths']['checkpoint']
+    if not config['training']['resume'] or not path.exists():
+        return None
+    
+    try:
+        checkpoint = torch.load(path, map_location=device)
+    except Exception as e:
+        print(f"Ignoring unreadable checkpoint {path}: {str(e)}")
+        return None
+    # Judged against the current settings, so raising MODEL_EPOCHS or the patience extends a finished run
+    patience = config['training']['early_stopping_patience']
+    if checkpoint['epoch'] >= config['training']['epochs'] or 0 < patience <= checkpoint['epochs_without_improvement']:
+        return None
+    return checkpoint
+
+# Training loop for one rank. Gradients are averaged across ranks by DDP, and only rank 0
+# evaluates, saves and checkpoints the model while the other ranks wait for its stop decision
+def run_training(rank, world_size, config, device, port, baseline_throughput):
+    distributed = world_size > 1
+    is_main = rank == 0
+    if distributed:
+        # Split the cores between ranks so their intra-op thread pools don't oversubscribe
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+        dist.init_process_group('gloo', init_method=f"tcp://127.0.0.1:{port}", rank=rank, world_size=world_size)
     
-    train_loader, test_loader = load_datasets(config)
+    # Every rank seeds the same initial weights; DDP also broadcasts rank 0's on construction
+    torch.manual_seed(0)
+    model = MNISTModel().to(device)
     optimizer = optim.SGD(
         model.parameters(), 
         lr=config['training']['learning_rate'], 
         momentum=config['training']['momentum']
     )
     
+    start_epoch = 1
     best_accuracy = 0.0
+    epochs_without_improvement = 0
+    checkpoint = load_resumable_checkpoint(config, device)
+    if checkpoint is not None:
+        model.load_state_dict(checkpoint['model'])
+        optimizer.load_state_dict(checkpoint['optimizer'])
+        torch.set_rng_state(checkpoint['rng_state'].cpu())
+        start_epoch = checkpoint['epoch'] + 1
+        best_accuracy = checkpoint['best_accuracy']
+        epochs_without_improvement = checkpoint['epochs_without_improvement']
+        if is_main:
+            print(f"Resuming training from epoch {start_epoch} (best accuracy so far: {best_accuracy:.2f}%)")
+    elif is_main:
+        print("Initializing new model for training...")
+    
+    if distributed:
+        model = DistributedDataParallel(model)
+    unwrapped = model.module if distributed else model
+    train_loader, test_loader = load_datasets(config, rank, world_size)
+    patience = config['training']['early_stopping_patience']
+    epoch_throughputs = []
     
-    print("Starting training...")
-    for epoch in range(1, config['training']['epochs'] + 1):
-        train_epoch(model, train_loader, optimizer, device, epoch)
-        accuracy = evaluate_model(model, test_loader, device)
+    if is_main:
+        print("Starting training...")
+    for epoch in range(start_epoch, config['training']['epochs'] + 1):
+        if distributed:
+            train_loader.sampler.sampler.set_epoch(epoch)
+        start = time.perf_counter()
+        train_epoch(model, train_loader, optimizer, device, epoch, log_progress=is_main)
+        if distributed:
+            dist.barrier()
+        epoch_throughputs.append(len(train_loader.dataset) / (time.perf_counter() - start))
         
-        if accuracy > best_accuracy:
-            best_accuracy = accuracy
-            print(f"New best accuracy: {best_accuracy:.2f}%")
-            save_model(model, accuracy, config)
-        else:
-            print(f"Accuracy: {accuracy:.2f}% (best so far: {best_accuracy:.2f}%)")
+        stop = False
+        if is_main:
+            print(f"Epoch {epoch} throughput: {epoch_throughputs[-1]:.0f} samples/s")
+            accuracy = evaluate_model(unwrapped, test_loader, device)
+            
+            if accuracy > best_accuracy:
+                best_accuracy = accuracy
+                epochs_without_improvement = 0
+                print(f"New best accuracy: {best_accuracy:.2f}%")
+                save_model(unwrapped, accuracy, config)
+            else:
+                epochs_without_improvement += 1
+                print(f"Accuracy: {accuracy:.2f}% (best so far: {best_accuracy:.2f}%)")
+            
+            stop = 0 < patience <= epochs_without_improvement
+            save_checkpoint(unwrapped, optimizer, epoch, best_accuracy, epochs_without_improvement, stop, config)
+            if stop:
+                print(f"Early stopping: no improvement for {epochs_without_improvement} epochs")
+        if distributed:
+            # Doubles as the barrier that holds the other ranks while rank 0 evaluates
+            stop_flag = torch.tensor(int(stop))
+            dist.broadcast(stop_flag, src=0)
+            stop = bool(stop_flag.item())
+        if stop:
+            break
     
-    print(f"Training completed! Best accuracy: {best_accuracy:.2f}%")
+    if is_main:
+        print(f"Training completed! Best accuracy: {best_accuracy:.2f}%")
+        if baseline_throughput is not None and epoch_throughputs:
+            throughput = sum(epoch_throughputs) / len(epoch_throughputs)
+            speedup = throughput / baseline_throughput
+            print(f"Scaling: {throughput:.0f} samples/s over {world_size} processes, "
+                  f"{speedup:.2f}x single-process ({100 * speedup / world_size:.0f}% efficiency)")
+    if distributed:
+        dist.destroy_process_group()
 
 # Main function to handle model training or loading
 def main():
@@ -180,17 +460,28 @@ def main():
     print("Attempting to load existing model...")
     model = load_existing_model(config, device)
     
-    if model is not None:
+    # An interrupted or extended run continues from its checkpoint even if weights were already saved
+    resuming = load_resumable_checkpoint(config, device) is not None
+    
+    if model is not None and not resuming:
+        if not inference_artifacts_exist(config):
+            _, test_loader = load_datasets(config)
+            export_inference_artifacts(model, test_loader, config)
         print("No training needed")
         sys.exit(0)
     
-    print("No valid existing model found - proceeding with training")
+    if resuming:
+        print("Found an unfinished training checkpoint - resuming training")
+    else:
+        print("No valid existing model found - proceeding with training")
     train_model(config, device)
     
     print("Verifying trained model...")
     model = load_existing_model(config, device)
     if model is not None:
         print("Trained model verified successfully")
+        _, test_loader = load_datasets(config)
+        export_inference_artifacts(model, test_loader, config)
         sys.exit(0)
     else:
         print("ERROR: Failed to verify trained model")
@@ -208,6 +499,12 @@ ENV_VARS = {
     'MODEL_EPOCHS': None,
     'MODEL_LEARNING_RATE': None,
     'MODEL_MOMENTUM': None,
+    'MODEL_LOADER_WORKERS': None,
+    'MODEL_PIN_MEMORY': None,
+    'MODEL_TRAINING_PROCESSES': None,
+    'MODEL_SCALING_BASELINE_BATCHES': None,
+    'MODEL_RESUME': None,
+    'MODEL_EARLY_STOPPING_PATIENCE': None,
     'CONTAINER_WORKDIR_NAME': None,
     'DATASET_DIR_NAME': None,
     'TRAINED_MODEL_DIR_NAME': None,
@@ -1,11 +1,17 @@
 # Standard library imports
 import os
 import sys
+import json
+import time
+import hashlib
+import threading
 
 # Third-party imports
+import numpy as np
 import streamlit as st
 from streamlit_drawable_canvas import st_canvas
 import requests
+from requests.adapters import HTTPAdapter
 
 
 # Load environment variables, return processed configuration
@@ -18,31 +24,90 @@ def load_environment_variables():
     config = {
         'api_base_url': f"http://{ENV_VARS['WEBSERVER_SERVICE_NAME']}:{ENV_VARS['WEBSERVER_PORT']}",
         'history_limit': int(ENV_VARS['PREDICTION_HISTORY_LIMIT']),
-        'canvas_size': 10 * int(ENV_VARS['MNIST_DATASET_IMAGE_SIZE'])
+        'image_size': int(ENV_VARS['MNIST_DATASET_IMAGE_SIZE']),
+        'canvas_size': 10 * int(ENV_VARS['MNIST_DATASET_IMAGE_SIZE']),
+        'timeout': (float(ENV_VARS['WEBAPP_CONNECT_TIMEOUT']), float(ENV_VARS['WEBAPP_READ_TIMEOUT'])),
+        'http_pool_size': int(ENV_VARS['WEBAPP_HTTP_POOL_SIZE']),
+        'history_ttl': float(ENV_VARS['WEBAPP_HISTORY_TTL_SECONDS'])
     }
     return config
 
-# Get prediction history from the webserver API
+# HTTP session shared by every Streamlit session and rerun, so keep-alive connections to the
+# webserver are reused instead of opening a new TCP connection per request
+@st.cache_resource
+def get_http_session():
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=CONFIG['http_pool_size']))
+    return session
+
+# Shrink the RGBA canvas to an image_size x image_size uint8 grayscale array by averaging each
+# block of canvas pixels, the same area resize the webserver applies to full size canvases
+def downsample_canvas(image_data):
+    block = CONFIG['canvas_size'] // CONFIG['image_size']
+    gray = np.asarray(image_data[..., :3], dtype=np.float32) @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    size = gray.shape[0] // block
+    blocks = gray[:size * block, :size * block].reshape(size, block, size, block)
+    return np.rint(blocks.mean(axis=(1, 3))).astype(np.uint8)
+
+# Identify the drawn strokes, so reruns that did not change the drawing reuse the last prediction
+def strokes_key(json_data):
+    return hashlib.blake2b(json.dumps(json_data["objects"], sort_keys=True).encode(), digest_size=16).hexdigest()
+
+# Prediction history shared by every Streamlit session. Newest first, like the webserver returns it
+@st.cache_resource
+def get_history_cache():
+    return {'rows': [], 'etag': None, 'fetched_at': None, 'lock': threading.Lock()}
+
+# Drop the cached history's freshness, so the next read checks the webserver for new rows
+def invalidate_prediction_history():
+    get_history_cache()['fetched_at'] = None
+
+# Get prediction history from the webserver API, at most once per WEBAPP_HISTORY_TTL_SECONDS across
+# all sessions. Refreshes only ask for rows newer than the newest cached one, conditionally on the
+# history's ETag, so an unchanged history costs one small 304 response
 def get_prediction_history():
-    try:
-        response = requests.get(
-            f"{CONFIG['api_base_url']}/prediction-history",
-            params={"limit": CONFIG['history_limit']}
-        )
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error fetching prediction history: {e}")
-        return []
+    cache = get_history_cache()
+    # Sessions arriving during a refresh wait for it instead of sending the same request
+    with cache['lock']:
+        if cache['fetched_at'] is not None and time.monotonic() - cache['fetched_at'] < CONFIG['history_ttl']:
+            return cache['rows']
+        params, headers = {"limit": CONFIG['history_limit']}, {}
+        if cache['etag'] is not None:
+            headers["If-None-Match"] = cache['etag']
+            if cache['rows']:
+                params["since"] = max(row["id"] for row in cache['rows'])
+        try:
+            response = get_http_session().get(
+                f"{CONFIG['api_base_url']}/prediction-history",
+                params=params,
+                headers=headers,
+                timeout=CONFIG['timeout']
+            )
+            if response.status_code != 304:
+                response.raise_for_status()
+                # Deltas repeat recently seen rows, in case some committed out of id order
+                rows = {row["id"]: row for row in (cache['rows'] if "since" in params else [])}
+                rows.update((row["id"], row) for row in response.json())
+                rows = sorted(rows.values(), key=lambda row: (row["timestamp"], row["id"]), reverse=True)
+                cache['rows'] = rows[:CONFIG['history_limit']]
+            cache['etag'] = response.headers.get("ETag")
+            cache['fetched_at'] = time.monotonic()
+        except requests.exceptions.RequestException as e:
+            st.error(f"Error fetching prediction history: {e}")
+        return cache['rows']
 
-# Get prediction from the webserver API
-def get_prediction(image_data):
+# Get prediction from the webserver API for a downsampled canvas, sent as raw bytes
+def get_prediction(image):
     try:
-        if image_data is not None and len(image_data.shape) == 3:
-            image_data_list = image_data.tolist()
-            response = requests.post(
+        if image is not None and len(image.shape) == 2:
+            response = get_http_session().post(
                 f"{CONFIG['api_base_url']}/predict",
-                json={"image_data": image_data_list}
+                data=image.tobytes(),
+                headers={
+                    "Content-Type": "application/octet-stream",
+                    "X-Image-Shape": ",".join(str(dim) for dim in image.shape)
+                },
+                timeout=CONFIG['timeout']
             )
             response.raise_for_status()
             result = response.json()
@@ -54,16 +119,18 @@ def get_prediction(image_data):
         st.error(f"Error getting prediction from server: {e}")
         return None, None
 
-# Log a prediction using the webserver API
-def log_prediction(predicted_digit, confidence, true_label):
+# Log a prediction using the webserver API, with the downsampled canvas it was made for
+def log_prediction(predicted_digit, confidence, true_label, image):
     try:
-        response = requests.post(
+        response = get_http_session().post(
             f"{CONFIG['api_base_url']}/log-prediction",
             json={
                 "predicted_digit": predicted_digit,
                 "confidence": confidence,
-                "true_label": true_label
-            }
+                "true_label": true_label,
+                "image_data": image[..., np.newaxis].tolist() if image is not None else None
+            },
+            timeout=CONFIG['timeout']
         )
         response.raise_for_status()
         return True
@@ -97,8 +164,19 @@ def main():
         if (canvas_result.image_data is not None and 
             canvas_result.json_data is not None and 
             canvas_result.json_data["objects"]):  # Check if there are drawn objects
-            # Get prediction from webserver
-            predicted_digit, confidence = get_prediction(canvas_result.image_data)
+            # Get prediction from webserver, unless the strokes are the ones already predicted
+            key = strokes_key(canvas_result.json_data)
+            if st.session_state.get("prediction_key") != key:
+                image = downsample_canvas(canvas_result.image_data)
+                prediction = get_prediction(image)
+                if prediction[0] is not None:
+                    st.session_state["prediction_key"] = key
+                    st.session_state["prediction"] = prediction
+                    # Kept to be logged with the prediction, so the labelled drawing can train the model
+                    st.session_state["prediction_image"] = image
+            else:
+                prediction = st.session_state["prediction"]
+            predicted_digit, confidence = prediction
             default_value = predicted_digit if predicted_digit is not None else 0
         else:
             predicted_digit = None
@@ -125,7 +203,9 @@ def main():
                                        label_visibility="collapsed")
             if st.button("Submit"):
                 if predicted_digit is not None and confidence is not None:
-                    if log_prediction(predicted_digit, confidence, true_label):
+                    if log_prediction(predicted_digit, confidence, true_label,
+                                      st.session_state.get("prediction_image")):
+                        invalidate_prediction_history()
                         st.info("Prediction logged successfully")
                     else:
                         st.warning("Failed to log prediction")
@@ -138,6 +218,7 @@ def main():
         st.dataframe(
             data=predictions,
             column_config={
+                "id": None,
                 "timestamp": st.column_config.DatetimeColumn(
                     "Timestamp",
                     format="YYYY-MM-DD HH:mm:ss"
@@ -159,6 +240,10 @@ ENV_VARS = {
     'WEBSERVER_PORT': None,
     'PREDICTION_HISTORY_LIMIT': None,
     'MNIST_DATASET_IMAGE_SIZE': None,
+    'WEBAPP_CONNECT_TIMEOUT': None,
+    'WEBAPP_READ_TIMEOUT': None,
+    'WEBAPP_HTTP_POOL_SIZE': None,
+    'WEBAPP_HISTORY_TTL_SECONDS': None,
 }
 CONFIG = load_environment_variables()
 
@@ -0,0 +1,203 @@
+# Standard library imports
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import platform
+import time
+from pathlib import Path
+
+# Third-party imports
+import httpx
+import numpy as np
+import torch
+
+# Local imports
+import webserver
+from benchmark_preprocessing import generate_canvases
+from load_test import percentiles_ms
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark preprocessing, forward pass and the full /predict round trip"
+    )
+    parser.add_argument('--variants', nargs='+', default=list(webserver.MODEL_VARIANTS),
+                        help="Model variants to benchmark")
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 8, 32, 128],
+                        help="Batch sizes for preprocessing and forward pass")
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 2, 4],
+                        help="torch intra-op thread counts for the forward pass")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8, 32],
+                        help="Concurrent clients for the /predict round trip")
+    parser.add_argument('--iterations', type=int, default=50, help="Timed iterations per configuration")
+    parser.add_argument('--requests', type=int, default=512, help="Requests per /predict round-trip run")
+    parser.add_argument('--payload-format', choices=['raw', 'json'], default='raw',
+                        help="Send canvases as raw uint8 bytes or as JSON image_data lists")
+    parser.add_argument('--payloads', type=Path, default=None,
+                        help="NPY file of recorded (N, H, W, 4) uint8 canvases to replay instead of generated ones")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for generated canvases")
+    parser.add_argument('--with-cache', action='store_true', help="Keep the prediction cache enabled")
+    parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'), help="Where to save results")
+    parser.add_argument('--compare', type=Path, default=None, help="Previous results JSON to compare against")
+    return parser.parse_args()
+
+# Load canned canvases, either recorded ones or generated from a fixed seed
+def load_payloads(args):
+    if args.payloads is not None:
+        return np.load(args.payloads, mmap_mode='r')
+    return generate_canvases(max(max(args.batch_sizes), 64), args.seed)
+
+# Switch the webserver to serve the given model variant
+def use_variant(variant):
+    webserver.CONFIG['model']['variant'] = variant
+    webserver.MODEL = None
+    webserver.load_model()
+
+# Summarise per-call latencies (seconds) with items processed per call
+def summarise(stage, latencies, items_per_call, **params):
+    return {
+        'stage': stage,
+        **params,
+        **{f"{name}_ms": value for name, value in percentiles_ms(latencies).items()},
+        'throughput': items_per_call * len(latencies) / sum(latencies)
+    }
+
+def time_calls(fn, iterations):
+    fn()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def benchmark_preprocessing(canvases, args):
+    results = []
+    for batch_size in args.batch_sizes:
+        batch = np.ascontiguousarray(canvases[:batch_size])
+        latencies = time_calls(lambda: webserver.preprocess_images(batch), args.iterations)
+        results.append(summarise('preprocess', latencies, len(batch), batch_size=len(batch)))
+    return results
+
+def benchmark_forward(canvases, variant, args):
+    results = []
+    images = webserver.preprocess_images(canvases[:max(args.batch_sizes)])
+    for threads in args.threads:
+        torch.set_num_threads(threads)
+        for batch_size in args.batch_sizes:
+            batch = images[:batch_size]
+            latencies = time_calls(lambda: webserver.predict_probabilities(batch), args.iterations)
+            results.append(summarise('forward', latencies, len(batch),
+                                     variant=variant, threads=threads, batch_size=len(batch)))
+    torch.set_num_threads(webserver.CONFIG['inference']['torch_threads'])
+    return results
+
+# Send requests from concurrent in-process clients through the whole ASGI app
+async def benchmark_round_trip(client, canvases, variant, args):
+    if args.payload_format == 'raw':
+        shape = ','.join(str(dim) for dim in canvases.shape[1:])
+        requests = [
+            {'content': np.ascontiguousarray(canvas).tobytes(),
+             'headers': {'Content-Type': 'application/octet-stream', 'X-Image-Shape': shape}}
+            for canvas in canvases
+        ]
+    else:
+        requests = [{'json': {'image_data': canvas.tolist()}} for canvas in canvases]
+
+    results = []
+    for concurrency in args.concurrency:
+        latencies = []
+        counter = iter(range(args.requests))
+
+        async def client_loop():
+            for i in counter:
+                start = time.perf_counter()
+                response = await client.post('/predict', **requests[i % len(requests)])
+                response.raise_for_status()
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        result = summarise('round_trip', latencies, 1, variant=variant, concurrency=concurrency,
+                           payload_format=args.payload_format)
+        # Concurrent requests overlap, so throughput comes from wall time rather than summed latency
+        result['throughput'] = len(latencies) / elapsed
+        results.append(result)
+    return results
+
+# Print how each configuration moved relative to a previous run
+def compare_results(results, previous_path):
+    with open(previous_path) as f:
+        previous = json.load(f)['results']
+
+    def key(result):
+        return tuple((name, value) for name, value in result.items()
+                     if not name.endswith('_ms') and name != 'throughput')
+
+    previous_by_key = {key(result): result for result in previous}
+    print(f"\nComparison with {previous_path} (p99 and throughput change):")
+    for result in results:
+        old = previous_by_key.get(key(result))
+        if old is None:
+            continue
+        label = ', '.join(f"{name}={value}" for name, value in key(result))
+        p99_change = 100 * (result['p99_ms'] / old['p99_ms'] - 1)
+        throughput_change = 100 * (result['throughput'] / old['throughput'] - 1)
+        print(f"{label:<72} p99 {p99_change:+6.1f}%  throughput {throughput_change:+6.1f}%")
+
+def print_results(results):
+    for result in results:
+        label = ', '.join(f"{name}={value}" for name, value in result.items()
+                          if not name.endswith('_ms') and name != 'throughput')
+        print(f"{label:<72} p50={result['p50_ms']:8.2f}ms p95={result['p95_ms']:8.2f}ms "
+              f"p99={result['p99_ms']:8.2f}ms throughput={result['throughput']:10.1f}/s")
+
+async def run(args):
+    webserver.import_torch()
+    canvases = load_payloads(args)
+    if not args.with_cache:
+        webserver.PREDICTION_CACHE.max_entries = 0
+
+    results = benchmark_preprocessing(canvases, args)
+    # The lifespan's worker pools can only be started once, so every variant shares one app lifetime
+    async with webserver.lifespan(webserver.fastApiApp):
+        # Let the startup load finish before switching variants
+        await webserver.fastApiApp.state.model_load_task
+        transport = httpx.ASGITransport(app=webserver.fastApiApp)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+            for variant in args.variants:
+                use_variant(variant)
+                results.extend(benchmark_forward(canvases, variant, args))
+                results.extend(await benchmark_round_trip(client, canvases, variant, args))
+    return results
+
+def main():
+    args = parse_args()
+    results = asyncio.run(run(args))
+    print_results(results)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'inference_config': webserver.CONFIG['inference'],
+            'args': {name: str(value) if isinstance(value, Path) else value for name, value in vars(args).items()}
+        },
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+    if args.compare is not None:
+        compare_results(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
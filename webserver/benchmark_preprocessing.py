@@ -0,0 +1,87 @@
+# Standard library imports
+import time
+
+# Third-party imports
+import numpy as np
+from PIL import Image, ImageDraw
+from torchvision import transforms
+
+# Local imports
+from inference_core import CONFIG, import_torch, preprocess_images
+
+
+# Agreement with the PIL path, in [0, 1] pixel units before normalization.
+# PIL's default resize filter is bicubic while preprocess_images averages areas,
+# so individual stroke-edge pixels differ by up to ~0.11 but the mean stays tiny.
+MAX_ABS_TOLERANCE = 0.12
+MEAN_ABS_TOLERANCE = 0.005
+
+BENCHMARK_CONFIG = {
+    'num_images': 256,
+    'batch_size': 32,
+    'repeats': 3,
+    'seed': 0,
+}
+
+
+# Previous PIL based preprocessing, kept as the reference implementation
+def process_image_pil(image_data):
+    image_gray = Image.fromarray(np.asarray(image_data, dtype=np.uint8)).convert('L')
+    image_size = CONFIG['dataset']['image_size']
+    image_resized = image_gray.resize((image_size, image_size))
+    image_tensor = transforms.ToTensor()(image_resized)
+    image_tensor = transforms.Normalize((CONFIG['dataset']['mean'],), (CONFIG['dataset']['std'],))(image_tensor)
+    return image_tensor.unsqueeze(0)
+
+# Generate reproducible RGBA canvases with random white strokes, like the webapp drawing canvas
+def generate_canvases(num_images, seed):
+    rng = np.random.default_rng(seed)
+    canvas_size = 10 * CONFIG['dataset']['image_size']
+    canvases = np.empty((num_images, canvas_size, canvas_size, 4), dtype=np.uint8)
+    for i in range(num_images):
+        canvas = Image.new('RGBA', (canvas_size, canvas_size), (0, 0, 0, 255))
+        points = rng.integers(canvas_size // 7, canvas_size - canvas_size // 7, size=(rng.integers(2, 6), 2))
+        ImageDraw.Draw(canvas).line([tuple(map(int, p)) for p in points], fill=(255, 255, 255, 255), width=20, joint='curve')
+        canvases[i] = np.asarray(canvas)
+    return canvases
+
+# Return the best wall time over several repeats, in seconds
+def time_best(fn, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+# Compare outputs of both paths in [0, 1] pixel units
+def check_agreement(canvases):
+    reference = np.concatenate([process_image_pil(canvas).numpy() for canvas in canvases])
+    vectorized = preprocess_images(canvases).numpy()
+    diff = np.abs(reference - vectorized) * CONFIG['dataset']['std']
+    print(f"Max abs difference: {diff.max():.4f} (tolerance {MAX_ABS_TOLERANCE})")
+    print(f"Mean abs difference: {diff.mean():.5f} (tolerance {MEAN_ABS_TOLERANCE})")
+    return diff.max() <= MAX_ABS_TOLERANCE and diff.mean() <= MEAN_ABS_TOLERANCE
+
+def main():
+    import_torch()
+    canvases = generate_canvases(BENCHMARK_CONFIG['num_images'], BENCHMARK_CONFIG['seed'])
+    if not check_agreement(canvases):
+        print("ERROR: Vectorized preprocessing is outside tolerance of the PIL path")
+        raise SystemExit(1)
+
+    num_images = len(canvases)
+    batch_size = BENCHMARK_CONFIG['batch_size']
+    repeats = BENCHMARK_CONFIG['repeats']
+    timings = {
+        'PIL, one image per call': time_best(lambda: [process_image_pil(c) for c in canvases], repeats),
+        'NumPy, one image per call': time_best(lambda: [preprocess_images(c[np.newaxis]) for c in canvases], repeats),
+        f'NumPy, {batch_size} images per call': time_best(
+            lambda: [preprocess_images(canvases[i:i + batch_size]) for i in range(0, num_images, batch_size)], repeats),
+    }
+    for name, seconds in timings.items():
+        print(f"{name:<32} {1e6 * seconds / num_images:8.1f} us/image  {num_images / seconds:10.0f} images/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+# Standard library imports
+import argparse
+import csv
+import multiprocessing
+import os
+import struct
+import time
+import zipfile
+from pathlib import Path
+
+# Third-party imports
+import numpy as np
+
+# Local imports
+import inference_core
+
+
+# idx files start with two zero bytes, a type code and the number of dimensions, then one
+# big-endian uint32 per dimension. Only unsigned byte images can be scored
+IDX_UBYTE = 0x08
+# Fixed part of a zip local file header, followed by the file name and extra field
+ZIP_LOCAL_HEADER = struct.Struct('<4s5H3I2H')
+
+OUTPUT_DTYPE = np.dtype([('predicted_digit', np.uint8), ('confidence', np.float32)])
+
+# Per-process state of pool workers, set up once by init_worker
+WORKER = {}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Score image files offline with the served model and webserver preprocessing"
+    )
+    parser.add_argument('inputs', nargs='+', type=Path,
+                        help="NPY, uncompressed NPZ or raw idx files of (N, H, W) or (N, H, W, C) uint8 images")
+    parser.add_argument('--npz-key', default=None, help="Array to score in NPZ files holding more than one")
+    parser.add_argument('--output', type=Path, required=True,
+                        help="Where to write predictions, format chosen by suffix: .csv, .npy or .parquet")
+    parser.add_argument('--variant', choices=inference_core.MODEL_VARIANTS,
+                        default=os.getenv('MODEL_VARIANT', 'float32'),
+                        help="Model variant to score with, MODEL_VARIANT if set")
+    parser.add_argument('--batch-size', type=int, default=256, help="Images per forward pass")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Scoring processes, 0 scores in this process")
+    parser.add_argument('--threads', type=int, default=1, help="torch intra-op threads per scoring process")
+    parser.add_argument('--progress-seconds', type=float, default=10.0, help="Seconds between progress lines")
+    return parser.parse_args()
+
+# Memory-map the images in a raw idx file, e.g. MNIST's t10k-images-idx3-ubyte
+def open_idx(path):
+    with open(path, 'rb') as f:
+        zeros, type_code, ndim = struct.unpack('>HBB', f.read(4))
+        if zeros != 0:
+            raise ValueError(f"Not an idx file: {path}")
+        if type_code != IDX_UBYTE:
+            raise ValueError(f"Expected unsigned byte idx data in {path}, got type code {type_code:#04x}")
+        shape = struct.unpack(f'>{ndim}I', f.read(4 * ndim))
+    return np.memmap(path, dtype=np.uint8, mode='r', offset=4 + 4 * ndim, shape=shape)
+
+# Memory-map one array stored in an NPZ archive. np.load reads NPZ members fully into memory,
+# but np.savez stores them uncompressed, so they can be mapped straight from the archive
+def open_npz_member(path, name=None):
+    with zipfile.ZipFile(path) as archive:
+        members = [info for info in archive.infolist() if info.filename.endswith('.npy')]
+        if name is not None:
+            members = [info for info in members if info.filename == f"{name}.npy"]
+        if len(members) != 1:
+            names = ', '.join(info.filename[:-4] for info in archive.infolist())
+            raise ValueError(f"Select one array of {path} with --npz-key, it contains: {names}")
+        info = members[0]
+        if info.compress_type != zipfile.ZIP_STORED:
+            raise ValueError(f"Array {info.filename} of {path} is compressed and cannot be memory-mapped, "
+                             f"save it with np.savez or np.save instead")
+
+    with open(path, 'rb') as f:
+        f.seek(info.header_offset)
+        header = ZIP_LOCAL_HEADER.unpack(f.read(ZIP_LOCAL_HEADER.size))
+        name_length, extra_length = header[-2:]
+        f.seek(name_length + extra_length, os.SEEK_CUR)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+# Memory-map the images of an input file, its format chosen by suffix
+def open_images(path, npz_key=None):
+    path = Path(path)
+    if path.suffix == '.gz':
+        raise ValueError(f"{path} is gzip compressed and cannot be memory-mapped, decompress it first")
+    if path.suffix == '.npy':
+        images = np.load(path, mmap_mode='r')
+    elif path.suffix == '.npz':
+        images = open_npz_member(path, npz_key)
+    else:
+        images = open_idx(path)
+    if images.ndim not in (3, 4):
+        raise ValueError(f"Expected images of shape (N, H, W) or (N, H, W, C) in {path}, got {images.shape}")
+    return images
+
+# Load the model once per scoring process, inputs are reopened there rather than pickled over
+def init_worker(sources, npz_key, variant, threads):
+    inference_core.import_torch().set_num_threads(threads)
+    WORKER['model'] = inference_core.read_model(variant)
+    WORKER['sources'] = sources
+    WORKER['npz_key'] = npz_key
+    WORKER['images'] = {}
+
+# Score images [start, stop) of one input, return the task with predicted digits and confidences
+def score_chunk(task):
+    source_index, start, stop = task
+    images = WORKER['images'].get(source_index)
+    if images is None:
+        images = WORKER['images'][source_index] = open_images(WORKER['sources'][source_index], WORKER['npz_key'])
+    probabilities = inference_core.predict_probabilities(
+        inference_core.preprocess_images(images[start:stop]), WORKER['model']
+    )
+    confidence, prediction = probabilities.max(dim=1)
+    return task, prediction.numpy().astype(np.uint8), confidence.numpy()
+
+class CsvWriter:
+    def __init__(self, path, total):
+        self.file = open(path, 'w', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['source', 'index', 'predicted_digit', 'confidence'])
+
+    def write(self, source, start, digits, confidences):
+        self.writer.writerows(
+            (source, start + i, digit, f"{confidence:.6f}")
+            for i, (digit, confidence) in enumerate(zip(digits.tolist(), confidences.tolist()))
+        )
+
+    def close(self):
+        self.file.close()
+
+# One structured row per image, in input order, written through a memory-mapped output file
+class NpyWriter:
+    def __init__(self, path, total):
+        self.array = np.lib.format.open_memmap(path, mode='w+', dtype=OUTPUT_DTYPE, shape=(total,))
+        self.position = 0
+
+    def write(self, source, start, digits, confidences):
+        rows = self.array[self.position:self.position + len(digits)]
+        rows['predicted_digit'] = digits
+        rows['confidence'] = confidences
+        self.position += len(digits)
+
+    def close(self):
+        self.array.flush()
+        del self.array
+
+class ParquetWriter:
+    def __init__(self, path, total):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise SystemExit("Parquet output needs pyarrow, install it with: pip install pyarrow")
+        self.pyarrow = pyarrow
+        self.schema = pyarrow.schema([
+            ('source', pyarrow.string()), ('index', pyarrow.int64()),
+            ('predicted_digit', pyarrow.uint8()), ('confidence', pyarrow.float32())
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, source, start, digits, confidences):
+        table = self.pyarrow.table({
+            'source': [source] * len(digits),
+            'index': np.arange(start, start + len(digits), dtype=np.int64),
+            'predicted_digit': digits,
+            'confidence': confidences
+        }, schema=self.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        self.writer.close()
+
+OUTPUT_WRITERS = {'.csv': CsvWriter, '.npy': NpyWriter, '.parquet': ParquetWriter}
+
+def main():
+    args = parse_args()
+    writer_class = OUTPUT_WRITERS.get(args.output.suffix)
+    if writer_class is None:
+        raise SystemExit(f"Unsupported output format {args.output.suffix!r}, use one of: {', '.join(OUTPUT_WRITERS)}")
+
+    sources = [str(source) for source in args.inputs]
+    try:
+        lengths = [len(open_images(source, args.npz_key)) for source in sources]
+    except (OSError, ValueError) as e:
+        raise SystemExit(f"ERROR: {str(e)}")
+    tasks = [(source_index, start, min(start + args.batch_size, length))
+             for source_index, length in enumerate(lengths)
+             for start in range(0, length, args.batch_size)]
+    total = sum(lengths)
+    print(f"Scoring {total} images from {len(sources)} file(s) with the {args.variant} model "
+          f"on {max(args.workers, 1)} process(es)")
+
+    writer = writer_class(args.output, total)
+    initargs = (sources, args.npz_key, args.variant, args.threads)
+    if args.workers > 0:
+        # Spawned rather than forked, so every worker starts its own torch thread pools
+        pool = multiprocessing.get_context('spawn').Pool(args.workers, initializer=init_worker, initargs=initargs)
+        results = pool.imap(score_chunk, tasks)
+    else:
+        pool = None
+        init_worker(*initargs)
+        results = map(score_chunk, tasks)
+
+    scored = 0
+    start_time = last_report = time.perf_counter()
+    try:
+        # Results arrive in input order and are written as they come, so memory does not grow with input size
+        for (source_index, start, _), digits, confidences in results:
+            writer.write(sources[source_index], start, digits, confidences)
+            scored += len(digits)
+            now = time.perf_counter()
+            if now - last_report >= args.progress_seconds:
+                print(f"{scored}/{total} images, {scored / (now - start_time):.1f} images/s")
+                last_report = now
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.terminate()
+
+    elapsed = time.perf_counter() - start_time
+    print(f"Scored {scored} images in {elapsed:.2f}s ({scored / elapsed:.1f} images/s), "
+          f"predictions saved to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
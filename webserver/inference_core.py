@@ -0,0 +1,195 @@
+# Model loading and image preprocessing shared by the web server and offline tools such as
+# bulk_score.py. Only the dataset and model path settings are read here, so tools importing this
+# module run without the server's database, inference and admission configuration
+
+# Standard library imports
+import os
+import sys
+import datetime
+import functools
+import hashlib
+import threading
+from pathlib import Path
+
+# Third-party imports. torch is imported by import_torch(), see below
+import numpy as np
+
+
+# Load environment variables, return processed configuration
+def load_environment_variables():
+    for var in ENV_VARS:
+        ENV_VARS[var] = os.getenv(var)
+        if ENV_VARS[var] is None:
+            print(f"Error: Missing required environment variable: {var}")
+            sys.exit(1)
+    model_dir = Path(f"/{ENV_VARS['CONTAINER_WORKDIR_NAME']}/{ENV_VARS['TRAINED_MODEL_DIR_NAME']}")
+    model_stem = Path(ENV_VARS['TRAINED_MODEL_NAME']).stem
+    config = {
+        'dataset': {
+            'image_size': int(ENV_VARS['MNIST_DATASET_IMAGE_SIZE']),
+            'mean': float(ENV_VARS['MNIST_DATASET_MEAN']),
+            'std': float(ENV_VARS['MNIST_DATASET_STD']),
+        },
+        'model': {
+            'variant_paths': {
+                'float32': model_dir / ENV_VARS['TRAINED_MODEL_NAME'],
+                'scripted': model_dir / f"{model_stem}_scripted.pt",
+                'quantized': model_dir / f"{model_stem}_quantized.pt"
+            },
+            'artifacts_manifest': model_dir / f"{model_stem}_artifacts.json"
+        }
+    }
+    return config
+
+
+# Import torch on first use and apply thread counts, if given, before it runs any parallel work.
+# Return the module
+def import_torch(torch_threads=None, torch_interop_threads=None):
+    global torch
+    with TORCH_IMPORT_LOCK:
+        if torch is None:
+            import torch as torch_module
+            # Inter-op threads can only be set once, before torch runs any parallel work
+            if torch_interop_threads is not None:
+                try:
+                    torch_module.set_num_interop_threads(torch_interop_threads)
+                except RuntimeError as e:
+                    print(f"Could not set torch inter-op threads: {str(e)}")
+            if torch_threads is not None:
+                torch_module.set_num_threads(torch_threads)
+            torch = torch_module
+    return torch
+
+# A loaded model with the device it runs on and a version identifying its weights. Inference takes
+# one reference for a whole forward pass, so swapping the global MODEL never affects a batch in flight
+class LoadedModel:
+    def __init__(self, model, device, version, variant, path, signature):
+        self.model = model
+        self.device = device
+        self.version = version
+        self.variant = variant
+        self.path = path
+        # (mtime_ns, size) of the file the weights were read from, to spot new ones
+        self.signature = signature
+        self.loaded_at = datetime.datetime.now()
+
+# Modification time and size of a model file, changed by every rewrite
+def model_file_signature(path):
+    stat = path.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Read a model variant from disk into a new LoadedModel
+def read_model(variant):
+    import_torch()
+    model_path = CONFIG['model']['variant_paths'][variant]
+    if not model_path.exists():
+        raise FileNotFoundError(f"Model not found at: {model_path}")
+    signature = model_file_signature(model_path)
+    with open(model_path, 'rb') as f:
+        digest = hashlib.file_digest(f, 'sha256').hexdigest()
+
+    if variant == 'float32':
+        model_dir = model_path.parent
+        if str(model_dir) not in sys.path:
+            sys.path.append(str(model_dir))
+
+        from model import MNISTModel
+
+        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        model = MNISTModel().to(device)
+        # Memory-mapped, so tensors are paged in from the file rather than unpickled from a copy of it
+        model.load_state_dict(torch.load(model_path, mmap=True, map_location=device))
+    else:
+        # TorchScript artifacts carry their own graph, and quantized kernels are CPU only
+        device = torch.device("cpu")
+        model = torch.jit.load(model_path, map_location=device)
+    model.eval()
+    # The version hash was taken before loading, so make sure it still describes the loaded file
+    if model_file_signature(model_path) != signature:
+        raise RuntimeError(f"Model file changed while loading: {model_path}")
+    # Identify the weights by content, so cached predictions never outlive them
+    version = f"{variant}-{digest[:12]}"
+    return LoadedModel(model, device, version, variant, model_path, signature)
+
+# Run one forward pass over a batch of images with a LoadedModel, return class probabilities of shape (N, 10)
+def predict_probabilities(images_tensor, loaded_model):
+    images_tensor = images_tensor.to(loaded_model.device)
+
+    with torch.no_grad():
+        output = loaded_model.model(images_tensor)
+        probabilities = torch.nn.functional.softmax(output, dim=1)
+
+    return probabilities.cpu()
+
+# Build an (out_size, in_size) matrix averaging the input pixels covered by each output pixel
+@functools.lru_cache(maxsize=16)
+def area_resize_matrix(in_size, out_size):
+    edges = np.arange(out_size + 1) * in_size / out_size
+    pixel_starts = np.arange(in_size)
+    overlap = (np.minimum(pixel_starts + 1, edges[1:, None]) -
+               np.maximum(pixel_starts, edges[:-1, None]))
+    weights = np.clip(overlap, 0, None)
+    return (weights / weights.sum(axis=1, keepdims=True)).astype(np.float32)
+
+# Weights turning C channels into grayscale: ITU-R 601-2 luma like PIL's convert('L'), alpha is ignored
+@functools.lru_cache(maxsize=4)
+def grayscale_weights(channels):
+    weights = np.zeros(channels, dtype=np.float32)
+    if channels >= 3:
+        weights[:3] = (0.299, 0.587, 0.114)
+    else:
+        weights[0] = 1.0
+    return weights
+
+# Preprocess a stack of uint8 images, (N, H, W) or (N, H, W, C), into a normalized tensor (N, 1, size, size)
+def preprocess_images(images):
+    import_torch()
+    images = np.asarray(images, dtype=np.uint8)
+    if images.ndim == 3:
+        images = images[..., np.newaxis]
+    elif images.ndim != 4:
+        raise ValueError(f"Expected images of shape (N, H, W) or (N, H, W, C), got {images.shape}")
+    num_images, height, width, channels = images.shape
+    image_size = CONFIG['dataset']['image_size']
+    gray_weights = grayscale_weights(channels)
+    row_matrix = area_resize_matrix(height, image_size)
+    # When each output column averages a contiguous run of whole pixels, grayscale conversion and
+    # column averaging fold into a single matrix-vector product over the raw bytes
+    block = width // image_size if width % image_size == 0 else None
+    if block is not None:
+        column_weights = np.tile(gray_weights, block) / block
+    else:
+        column_matrix = area_resize_matrix(width, image_size)
+    resized = np.empty((num_images, image_size, image_size), dtype=np.float32)
+    # One image at a time keeps the float32 temporaries cache-resident
+    for i in range(num_images):
+        if block is not None:
+            pixels = images[i].reshape(height * image_size, block * channels).astype(np.float32)
+            columns = (pixels @ column_weights).reshape(height, image_size)
+        else:
+            columns = (images[i].astype(np.float32) @ gray_weights) @ column_matrix.T
+        resized[i] = row_matrix @ columns
+    # Apply [0, 1] scaling and MNIST normalization in one multiply-add
+    resized *= PIXEL_SCALE
+    resized -= PIXEL_OFFSET
+    return torch.from_numpy(resized).unsqueeze(1)
+
+
+# Environment variables setup
+ENV_VARS = {
+    'CONTAINER_WORKDIR_NAME': None,
+    'TRAINED_MODEL_DIR_NAME': None,
+    'TRAINED_MODEL_NAME': None,
+    'MNIST_DATASET_IMAGE_SIZE': None,
+    'MNIST_DATASET_MEAN': None,
+    'MNIST_DATASET_STD': None,
+}
+MODEL_VARIANTS = ('float32', 'scripted', 'quantized')
+CONFIG = load_environment_variables()
+
+# Fold ToTensor's division by 255 and MNIST normalization into precomputed constants
+PIXEL_SCALE = 1 / (255 * CONFIG['dataset']['std'])
+PIXEL_OFFSET = CONFIG['dataset']['mean'] / CONFIG['dataset']['std']
+
+torch = None
+TORCH_IMPORT_LOCK = threading.Lock()
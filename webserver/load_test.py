@@ -0,0 +1,86 @@
+# Standard library imports
+import argparse
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+# Third-party imports
+import numpy as np
+
+
+# Build a reproducible 280x280 RGBA canvas with a vertical stroke, like a drawn "1"
+def build_canvas():
+    canvas = np.zeros((280, 280, 4), dtype=np.uint8)
+    canvas[..., 3] = 255
+    canvas[60:220, 130:150, :3] = 255
+    return canvas
+
+# Send one request, return its latency in seconds and whether it succeeded
+def timed_request(request):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+        ok = True
+    except (urllib.error.URLError, TimeoutError):
+        ok = False
+    return time.perf_counter() - start, ok
+
+# Keep sending requests built by make_request until the deadline, recording latencies
+def client_loop(make_request, deadline, results, lock):
+    while time.perf_counter() < deadline:
+        latency, ok = timed_request(make_request())
+        with lock:
+            results.append((latency, ok))
+
+def percentiles_ms(latencies):
+    if not latencies:
+        return {'p50': float('nan'), 'p95': float('nan'), 'p99': float('nan')}
+    values = np.percentile(np.array(latencies) * 1000, [50, 95, 99])
+    return dict(zip(('p50', 'p95', 'p99'), values))
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Mixed-load latency test: /predict clients running alongside database-bound /health clients"
+    )
+    parser.add_argument('--url', default='http://localhost:8000', help="Base URL of a running webserver")
+    parser.add_argument('--predict-clients', type=int, default=16, help="Concurrent /predict clients")
+    parser.add_argument('--db-clients', type=int, default=4, help="Concurrent /health clients")
+    parser.add_argument('--duration', type=float, default=20.0, help="Test duration in seconds")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    body = build_canvas().tobytes()
+
+    def make_predict_request():
+        return urllib.request.Request(
+            f"{args.url}/predict", data=body, method='POST',
+            headers={'Content-Type': 'application/octet-stream', 'X-Image-Shape': '280,280,4'}
+        )
+
+    def make_health_request():
+        return urllib.request.Request(f"{args.url}/health")
+
+    results = {'/predict': [], '/health': []}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+    clients = ([('/predict', make_predict_request)] * args.predict_clients +
+               [('/health', make_health_request)] * args.db_clients)
+    with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+        for endpoint, make_request in clients:
+            pool.submit(client_loop, make_request, deadline, results[endpoint], lock)
+
+    for endpoint, samples in results.items():
+        latencies = [latency for latency, _ in samples]
+        errors = sum(1 for _, ok in samples if not ok)
+        stats = percentiles_ms(latencies)
+        print(f"{endpoint:<10} requests={len(samples):6d} errors={errors:5d} "
+              f"throughput={len(samples) / args.duration:8.1f}/s "
+              f"p50={stats['p50']:8.1f}ms p95={stats['p95']:8.1f}ms p99={stats['p99']:8.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
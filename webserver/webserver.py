@@ -1,22 +1,78 @@
 # Standard library imports
 import os
+import io
 import sys
+import json
+import re
+import asyncio
+import bisect
+import contextvars
 import datetime
-from pathlib import Path
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
 
-# Third-party imports
-import torch
-from torchvision import transforms
+# Third-party imports. torch is imported by import_torch() and PIL only for PNG uploads, see below
 import numpy as np
-from PIL import Image
 import psycopg2
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.extras
+import psycopg2.pool
+from fastapi import FastAPI, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError
 import uvicorn
 
+# Local imports
+import inference_core
+from inference_core import (
+    MODEL_VARIANTS, PIXEL_OFFSET, PIXEL_SCALE, model_file_signature, preprocess_images, read_model
+)
+
+
+# Open the database connection pool and check its schema at startup, without failing it
+async def open_db_pool():
+    try:
+        await run_blocking(DB_EXECUTOR, DB_POOL.open)
+    except HTTPException as e:
+        # The database may still be starting, the pool is opened again on first use
+        print(f"Could not open database connection pool at startup: {e.detail}")
+        return
+    try:
+        await run_blocking(DB_EXECUTOR, check_db_schema)
+    except HTTPException as e:
+        print(f"ERROR: {e.detail}")
+
+# Start background services on startup and stop them on shutdown. The model is imported, loaded and
+# warmed up on its own thread while the database pool opens on another; with MODEL_BACKGROUND_LOAD the server
+# starts answering straight away and reports ready through /health/ready once the model is loaded
+@asynccontextmanager
+async def lifespan(app):
+    app.state.model_load_task = asyncio.create_task(run_blocking(MODEL_LOAD_EXECUTOR, load_model))
+    # Opened in the background, so an unreachable database does not hold up startup for DB_TIMEOUT
+    app.state.db_open_task = asyncio.create_task(open_db_pool())
+    if not CONFIG['model']['background_load']:
+        await app.state.model_load_task
+    await BATCHER.start()
+    await LOG_WRITER.start()
+    await MODEL_RELOADER.start()
+    yield
+    await MODEL_RELOADER.stop()
+    await BATCHER.stop()
+    await LOG_WRITER.stop()
+    await app.state.db_open_task
+    for executor in (INFERENCE_EXECUTOR, DB_EXECUTOR, MODEL_LOAD_EXECUTOR):
+        if executor is not None:
+            executor.shutdown(wait=True)
+    DB_POOL.close()
 
 # Create FastAPI app
-fastApiApp = FastAPI(title="MNIST Digit Recogniser Web Server")
+fastApiApp = FastAPI(title="MNIST Digit Recogniser Web Server", lifespan=lifespan)
 
 
 # Pydantic models for request/response
@@ -29,34 +85,80 @@ class PredictionRequest(BaseModel):
 class PredictionResponse(BaseModel):
     predicted_digit: int
     confidence: float
+    model_version: str
 
-class PredictionLogRequest(BaseModel):
+class BatchPredictionRequest(BaseModel):
+    images: list[list[list[list[int]]]]
+
+class DigitProbability(BaseModel):
+    digit: int
+    probability: float
+
+class BatchPredictionItem(BaseModel):
     predicted_digit: int
     confidence: float
-    true_label: int
+    top_k: list[DigitProbability] | None = None
+
+class BatchPredictionResponse(BaseModel):
+    model_version: str
+    predictions: list[BatchPredictionItem]
+
+class PredictionLogRequest(BaseModel):
+    predicted_digit: int = Field(ge=0, le=9)
+    confidence: float = Field(ge=0, le=1)
+    true_label: int = Field(ge=0, le=9)
+    image_data: list[list[list[int]]] | None = None
 
 class PredictionHistoryResponse(BaseModel):
+    id: int
     timestamp: datetime.datetime
     predicted_digit: int
     true_label: int | None
     confidence: float
 
+class DigitAccuracy(BaseModel):
+    digit: int
+    count: int
+    correct: int
+    accuracy: float | None
+
+class ConfidenceHistogram(BaseModel):
+    bin_edges: list[float]
+    correct: list[int]
+    incorrect: list[int]
+
+class AccuracyAnalyticsResponse(BaseModel):
+    start: datetime.datetime | None
+    end: datetime.datetime | None
+    total: int
+    correct: int
+    accuracy: float | None
+    per_digit: list[DigitAccuracy]
+    confusion_matrix: list[list[int]]
+    confidence_histogram: ConfidenceHistogram
+
 
 # Load environment variables, return processed configuration
 def load_environment_variables():
     for var in ENV_VARS:
         ENV_VARS[var] = os.getenv(var)
         if ENV_VARS[var] is None:
-            raise HTTPException(status_code=500, detail=f"Missing required environment variable: {var}")
+            print(f"Error: Missing required environment variable: {var}")
+            sys.exit(1)
+    if ENV_VARS['MODEL_VARIANT'] not in MODEL_VARIANTS:
+        print(f"Error: Unknown MODEL_VARIANT: {ENV_VARS['MODEL_VARIANT']}")
+        sys.exit(1)
+    # Dataset and model path settings are shared with offline tools, see inference_core.py
+    shared_config = inference_core.CONFIG
     config = {
-        'dataset': {
-            'image_size': int(ENV_VARS['MNIST_DATASET_IMAGE_SIZE']),
-            'mean': float(ENV_VARS['MNIST_DATASET_MEAN']),
-            'std': float(ENV_VARS['MNIST_DATASET_STD']),
-        },
+        'dataset': shared_config['dataset'],
         'model': {
-            'path': Path(f"/{ENV_VARS['CONTAINER_WORKDIR_NAME']}/{ENV_VARS['TRAINED_MODEL_DIR_NAME']}/{ENV_VARS['TRAINED_MODEL_NAME']}"),
-            'file': ENV_VARS['MODEL_FILE_NAME']
+            **shared_config['model'],
+            'path': shared_config['model']['variant_paths']['float32'],
+            'file': ENV_VARS['MODEL_FILE_NAME'],
+            'variant': ENV_VARS['MODEL_VARIANT'],
+            'warmup_batches': int(ENV_VARS['MODEL_WARMUP_BATCHES']),
+            'background_load': ENV_VARS['MODEL_BACKGROUND_LOAD'].lower() == 'true'
         },
         'db': {
             'host': ENV_VARS['DB_SERVICE_NAME'],
@@ -64,158 +166,1513 @@ def load_environment_variables():
             'database': ENV_VARS['DB_NAME'],
             'user': ENV_VARS['DB_USER'],
             'password': ENV_VARS['DB_PASSWORD'],
-            'timeout': int(ENV_VARS['DB_TIMEOUT'])
+            'timeout': int(ENV_VARS['DB_TIMEOUT']),
+            'workers': int(ENV_VARS['DB_WORKERS']),
+            'pool_min_size': int(ENV_VARS['DB_POOL_MIN_SIZE']),
+            'pool_max_size': int(ENV_VARS['DB_POOL_MAX_SIZE']),
+            'pool_validate_idle_seconds': float(ENV_VARS['DB_POOL_VALIDATE_IDLE_SECONDS'])
+        },
+        'prediction_log': {
+            'buffer_size': int(ENV_VARS['PREDICTION_LOG_BUFFER_SIZE']),
+            'flush_size': int(ENV_VARS['PREDICTION_LOG_FLUSH_SIZE']),
+            'flush_interval_ms': float(ENV_VARS['PREDICTION_LOG_FLUSH_INTERVAL_MS']),
+            'wait_for_commit': ENV_VARS['PREDICTION_LOG_WAIT_FOR_COMMIT'].lower() == 'true'
+        },
+        'prediction_history': {
+            'overlap_ids': int(ENV_VARS['PREDICTION_HISTORY_OVERLAP_IDS'])
+        },
+        'prediction_cache': {
+            'max_entries': int(ENV_VARS['PREDICTION_CACHE_MAX_ENTRIES']),
+            'ttl_seconds': float(ENV_VARS['PREDICTION_CACHE_TTL_SECONDS'])
+        },
+        'inference': {
+            'max_batch_size': int(ENV_VARS['INFERENCE_MAX_BATCH_SIZE']),
+            'max_wait_ms': float(ENV_VARS['INFERENCE_MAX_WAIT_MS']),
+            'max_request_images': int(ENV_VARS['INFERENCE_MAX_REQUEST_IMAGES']),
+            'workers': int(ENV_VARS['INFERENCE_WORKERS']),
+            'torch_threads': int(ENV_VARS['INFERENCE_TORCH_THREADS']),
+            'torch_interop_threads': int(ENV_VARS['INFERENCE_TORCH_INTEROP_THREADS'])
+        },
+        'admission': {
+            'max_in_flight': int(ENV_VARS['ADMISSION_MAX_IN_FLIGHT']),
+            'default_timeout_ms': float(ENV_VARS['ADMISSION_DEFAULT_TIMEOUT_MS']),
+            'retry_after_seconds': int(ENV_VARS['ADMISSION_RETRY_AFTER_SECONDS'])
+        },
+        'model_reload': {
+            'poll_seconds': float(ENV_VARS['MODEL_RELOAD_POLL_SECONDS'])
+        },
+        'metrics': {
+            'enabled': ENV_VARS['METRICS_ENABLED'].lower() == 'true',
+            'timing_headers': ENV_VARS['METRICS_TIMING_HEADERS'].lower() == 'true'
         }
     }
     return config
 
 
-# Get a connection to the PostgreSQL database
-def get_db_connection():
+# Import torch on first use and apply the configured thread counts, return the module. torch accounts
+# for most of the server's import time, so deferring it lets the process bind its port, answer
+# liveness probes and open the database pool while the import runs on the model loading thread
+def import_torch():
+    global torch
+    torch = inference_core.import_torch(
+        CONFIG['inference']['torch_threads'], CONFIG['inference']['torch_interop_threads']
+    )
+    return torch
+
+# Initializer for threads that run torch work, intra-op parallelism is set per thread
+def init_torch_thread(torch_threads):
+    import_torch().set_num_threads(torch_threads)
+
+# Create a dedicated thread pool, or None to run work inline on the event loop when size is 0
+def create_executor(workers, name, initializer=None, initargs=()):
+    if workers <= 0:
+        return None
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name, initializer=initializer, initargs=initargs)
+
+# Run a blocking function on a worker pool so it does not stall other requests on the event loop.
+# The caller's context goes along, so stage timings recorded on the worker count towards its request
+async def run_blocking(executor, fn, *args):
+    if executor is None:
+        return fn(*args)
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(executor, context.run, fn, *args)
+
+# Fixed-bucket latency histogram, kept as per-bucket counts and rendered cumulatively for Prometheus
+class Histogram:
+    BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+# Format Prometheus labels, escaping values as the text exposition format requires
+def format_labels(labels):
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+# Render a component's stats() as Prometheus series: numbers become gauges (counters for *_total keys),
+# count dicts become one labelled series per entry and strings become labels of an info series
+def render_component_stats(lines, prefix, stats):
+    info = {}
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, str):
+            info[key] = value
+        elif isinstance(value, dict):
+            label = key.removesuffix('_counts')
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(f"{name}{format_labels({label: entry})} {count}" for entry, count in value.items())
+        elif isinstance(value, (bool, int, float)):
+            lines.append(f"# TYPE {name} {'counter' if key.endswith('_total') else 'gauge'}")
+            lines.append(f"{name} {float(value)}")
+    if info:
+        lines.append(f"# TYPE {prefix}_info gauge")
+        lines.append(f"{prefix}_info{format_labels(info)} 1")
+
+# Request counters and latency histograms per endpoint, and timing histograms per processing stage.
+# Stage timings also accumulate into the current request's REQUEST_TIMINGS for the Server-Timing header
+class Metrics:
+    def __init__(self, enabled, timing_headers):
+        self.enabled = enabled
+        self.timing_headers = timing_headers
+        self.lock = threading.Lock()
+        self.requests_total = Counter()
+        self.request_histograms = defaultdict(Histogram)
+        self.stage_histograms = defaultdict(Histogram)
+
+    def observe_stage(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.stage_histograms[stage].observe(seconds)
+        timings = REQUEST_TIMINGS.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def time_stage(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - start)
+
+    def observe_request(self, method, endpoint, status, seconds):
+        with self.lock:
+            self.requests_total[(method, endpoint, status)] += 1
+            self.request_histograms[(method, endpoint)].observe(seconds)
+
+    def _render_histograms(self, lines, name, histograms):
+        lines.append(f"# TYPE {name} histogram")
+        for label_pairs, histogram in sorted(histograms.items()):
+            labels = dict(label_pairs)
+            cumulative = 0
+            for bound, count in zip(Histogram.BUCKETS + (float('inf'),), histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                lines.append(f"{name}_bucket{format_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+
+    # Render all metrics, plus the stats() of each component, in the Prometheus text format
+    def render(self, components):
+        lines = ["# TYPE mnist_http_requests_total counter"]
+        with self.lock:
+            lines.extend(
+                f"mnist_http_requests_total{format_labels({'method': method, 'endpoint': endpoint, 'status': status})} {count}"
+                for (method, endpoint, status), count in sorted(self.requests_total.items())
+            )
+            self._render_histograms(lines, 'mnist_http_request_duration_seconds', {
+                (('method', method), ('endpoint', endpoint)): histogram
+                for (method, endpoint), histogram in self.request_histograms.items()
+            })
+            self._render_histograms(lines, 'mnist_stage_duration_seconds', {
+                (('stage', stage),): histogram for stage, histogram in self.stage_histograms.items()
+            })
+        for component, stats in components.items():
+            render_component_stats(lines, f"mnist_{component}", stats)
+        return '\n'.join(lines) + '\n'
+
+# ASGI middleware counting requests and timing them per route template, and optionally
+# reporting each request's stage timings in a Server-Timing response header
+class MetricsMiddleware:
+    def __init__(self, app, metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        timings = {}
+        token = REQUEST_TIMINGS.set(timings)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_timings(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                if self.metrics.timing_headers:
+                    timings['total'] = time.perf_counter() - start
+                    server_timing = ', '.join(f"{stage};dur={1000 * seconds:.3f}" for stage, seconds in timings.items())
+                    message = {**message, 'headers': [*message.get('headers', []), (b'server-timing', server_timing.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            REQUEST_TIMINGS.reset(token)
+            # Label by route template, so path parameters and unknown paths cannot explode the series count
+            route = scope.get('route')
+            endpoint = route.path if route is not None else 'unmatched'
+            self.metrics.observe_request(scope['method'], endpoint, status, time.perf_counter() - start)
+
+# Pool of PostgreSQL connections shared by the database worker threads
+class DatabasePool:
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.min_size = db_config['pool_min_size']
+        self.max_size = db_config['pool_max_size']
+        self.acquire_timeout = db_config['timeout']
+        self.validate_idle_seconds = db_config['pool_validate_idle_seconds']
+        self.pool = None
+        self.last_used = {}
+        # Guards the counters and the pool reference. Opening holds its own lock for the whole
+        # connect, so stats() never waits up to DB_TIMEOUT on an unreachable database
+        self.lock = threading.Lock()
+        self.open_lock = threading.Lock()
+        # psycopg2 pools fail immediately when exhausted, the semaphore makes callers wait instead
+        self.slots = threading.BoundedSemaphore(self.max_size)
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.acquisitions_total = 0
+        self.waits_total = 0
+        self.acquire_timeouts_total = 0
+        self.discarded_total = 0
+
+    # Create the pool and its min_size connections, if not already created
+    def open(self):
+        if self.pool is not None:
+            return
+        with self.open_lock:
+            if self.pool is not None:
+                return
+            try:
+                pool = psycopg2.pool.ThreadedConnectionPool(
+                    self.min_size,
+                    self.max_size,
+                    host=self.db_config['host'],
+                    port=self.db_config['port'],
+                    database=self.db_config['database'],
+                    user=self.db_config['user'],
+                    password=self.db_config['password'],
+                    connect_timeout=self.db_config['timeout']
+                )
+            except psycopg2.Error as e:
+                raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
+            with self.lock:
+                self.pool = pool
+
+    def close(self):
+        with self.open_lock:
+            with self.lock:
+                pool, self.pool = self.pool, None
+            if pool is not None:
+                pool.closeall()
+
+    # Borrow a validated connection, waiting up to DB_TIMEOUT seconds for one to become free
+    @contextmanager
+    def connection(self):
+        start = time.perf_counter()
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.waits_total += 1
+            if not self.slots.acquire(timeout=self.acquire_timeout):
+                with self.lock:
+                    self.acquire_timeouts_total += 1
+                raise HTTPException(status_code=503, detail="Timed out waiting for a database connection")
+        try:
+            conn = self._checkout()
+            with self.lock:
+                self.in_use += 1
+                self.peak_in_use = max(self.peak_in_use, self.in_use)
+                self.acquisitions_total += 1
+            acquired = time.perf_counter()
+            METRICS.observe_stage('db_acquire', acquired - start)
+            broken = False
+            try:
+                yield conn
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                broken = True
+                raise
+            finally:
+                METRICS.observe_stage('db_query', time.perf_counter() - acquired)
+                with self.lock:
+                    self.in_use -= 1
+                self._checkin(conn, broken)
+        finally:
+            self.slots.release()
+
+    # Hand out the first idle connection that passes validation. Once max_size were discarded
+    # no idle ones are left, so the pool opens a new connection
+    def _checkout(self):
+        self.open()
+        try:
+            for _ in range(self.max_size):
+                conn = self.pool.getconn()
+                if self._is_usable(conn):
+                    return conn
+                self.pool.putconn(conn, close=True)
+                with self.lock:
+                    self.discarded_total += 1
+            return self.pool.getconn()
+        except psycopg2.Error as e:
+            raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
+
+    # Reject connections the server has closed, and ping ones that sat idle long enough to be dropped
+    def _is_usable(self, conn):
+        if conn.closed or conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        idle_seconds = time.monotonic() - self.last_used.get(id(conn), 0.0)
+        if idle_seconds < self.validate_idle_seconds:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkin(self, conn, broken):
+        if self.pool is None:
+            conn.close()
+            return
+        if not broken and not conn.closed:
+            try:
+                # Leave no transaction open on connections returned to the pool
+                conn.rollback()
+            except psycopg2.Error:
+                broken = True
+        if broken or conn.closed:
+            with self.lock:
+                self.discarded_total += 1
+            # A broken connection usually means the server dropped them all, e.g. on a restart,
+            # so ping every idle connection on its next checkout however recently it was used
+            self.last_used.clear()
+        else:
+            self.last_used[id(conn)] = time.monotonic()
+        self.pool.putconn(conn, close=broken or bool(conn.closed))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'open': self.pool is not None,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'in_use': self.in_use,
+                'peak_in_use': self.peak_in_use,
+                'saturation': self.in_use / self.max_size,
+                'acquisitions_total': self.acquisitions_total,
+                'waits_total': self.waits_total,
+                'acquire_timeouts_total': self.acquire_timeouts_total,
+                'discarded_total': self.discarded_total
+            }
+
+# Decode a binary image upload into a uint8 array, sharing memory with the request body where possible
+def decode_image_payload(body, content_type, image_shape):
     try:
-        return psycopg2.connect(
-            host=CONFIG['db']['host'],
-            port=CONFIG['db']['port'],
-            database=CONFIG['db']['database'],
-            user=CONFIG['db']['user'],
-            password=CONFIG['db']['password'],
-            connect_timeout=CONFIG['db']['timeout']
-        )
-    except psycopg2.Error as e:
-        raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
+        if content_type == 'application/octet-stream':
+            # Raw uint8 pixels, shape given in the X-Image-Shape header, e.g. "280,280,4"
+            if image_shape is None:
+                raise ValueError("X-Image-Shape header is required for application/octet-stream uploads")
+            shape = tuple(int(dim) for dim in image_shape.split(','))
+            if any(dim <= 0 for dim in shape):
+                raise ValueError(f"X-Image-Shape dimensions must be positive, got {image_shape}")
+            image = np.frombuffer(body, dtype=np.uint8).reshape(shape)
+        elif content_type == 'application/x-npy':
+            buffer = io.BytesIO(body)
+            version = np.lib.format.read_magic(buffer)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(buffer)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(buffer)
+            if dtype != np.uint8 or fortran_order:
+                raise ValueError(f"Expected a C-ordered uint8 array, got dtype {dtype}")
+            image = np.frombuffer(body, dtype=np.uint8, offset=buffer.tell()).reshape(shape)
+        elif content_type == 'image/png':
+            from PIL import Image
+            image = np.asarray(Image.open(io.BytesIO(body)))
+        else:
+            raise HTTPException(status_code=415, detail=f"Unsupported content type: {content_type}")
+        if image.size == 0:
+            raise ValueError(f"Image is empty, got shape {image.shape}")
+        return image
+    # PIL raises OSError (UnidentifiedImageError) for bodies that are not a readable PNG
+    except (ValueError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid image payload: {str(e)}")
 
-# Load the trained model if not already loaded
+# Read a model variant, run warmup batches at the batcher's smallest and largest batch sizes,
+# and check it produces finite scores for all 10 digits before it serves any request
+def prepare_model(variant, warmup_batches):
+    import_torch()
+    candidate = read_model(variant)
+    image_size = CONFIG['dataset']['image_size']
+    generator = torch.Generator().manual_seed(0)
+    pixels = torch.rand((CONFIG['inference']['max_batch_size'], 1, image_size, image_size), generator=generator)
+    probe = pixels * (255 * PIXEL_SCALE) - PIXEL_OFFSET
+    for i in range(warmup_batches):
+        predict_probabilities(probe[:1] if i % 2 else probe, candidate)
+    
+    with torch.no_grad():
+        scores = candidate.model(probe.to(candidate.device))
+    if tuple(scores.shape) != (len(probe), 10):
+        raise ValueError(f"Expected scores of shape {(len(probe), 10)}, got {tuple(scores.shape)}")
+    if not torch.isfinite(scores).all():
+        raise ValueError("Model produced non-finite scores")
+    return candidate
+
+# Load, warm up and validate the trained model if not already loaded, in the variant selected by MODEL_VARIANT
 def load_model():
     global MODEL
-    if MODEL is None:
-        try:
-            if not CONFIG['model']['path'].exists():
-                raise FileNotFoundError(f"Model not found at: {CONFIG['model']['path']}")
-            
-            model_dir = CONFIG['model']['path'].parent
-            if str(model_dir) not in sys.path:
-                sys.path.append(str(model_dir))
-            
-            from model import MNISTModel
-            
-            device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-            MODEL = MNISTModel().to(device)
-            
-            MODEL.load_state_dict(torch.load(CONFIG['model']['path'], map_location=device))
-            MODEL.eval()
+    if MODEL is not None:
+        return MODEL
+    with MODEL_LOAD_LOCK:
+        if MODEL is None:
+            try:
+                variant = CONFIG['model']['variant']
+                start = time.perf_counter()
+                MODEL = prepare_model(variant, CONFIG['model']['warmup_batches'])
+                print(f"Loaded {variant} model {MODEL.version} from {MODEL.path} in "
+                      f"{time.perf_counter() - start:.2f}s{describe_model_accuracy(variant)}")
 
-        except Exception as e:
-            import traceback
-            print(f"Error loading model: {str(e)}")
-            print(traceback.format_exc())
-            raise HTTPException(status_code=500, detail=f"Model loading error: {str(e)}")
+            except Exception as e:
+                import traceback
+                print(f"Error loading model: {str(e)}")
+                print(traceback.format_exc())
+                raise HTTPException(status_code=500, detail=f"Model loading error: {str(e)}")
     return MODEL
 
-# Process the image data for prediction
+# Return the served model, or 503 while it is still loading in the background
+def require_model():
+    if MODEL is None:
+        raise HTTPException(status_code=503, detail="Model is still loading", headers={'Retry-After': '1'})
+    return MODEL
+
+# Describe the test set accuracy recorded by training for a model variant, if available
+def describe_model_accuracy(variant):
+    try:
+        with open(CONFIG['model']['artifacts_manifest']) as f:
+            entry = json.load(f)[variant]
+        return f" (test accuracy {entry['accuracy']:.2f}%, {entry['accuracy_delta']:+.2f} vs float32)"
+    except (OSError, KeyError, ValueError):
+        return ""
+
+# Process the image data for prediction, shape (H, W) or (H, W, C), into a tensor (1, 1, size, size)
 def process_image(image_data):
     try:
-        # Convert image_data to PIL Image
-        image_pil = Image.fromarray(np.array(image_data, dtype=np.uint8))
-        # Convert RGBA to Grayscale
-        image_gray = image_pil.convert('L')
-        # Resize to MNIST size
-        image_size = CONFIG['dataset']['image_size']
-        image_resized = image_gray.resize((image_size, image_size))
-        print(f"Image resized: {np.array(image_resized)}")
-        # Convert to float tensor: shape (1, image_size, image_size), range [0, 1]
-        image_tensor = transforms.ToTensor()(image_resized)
-        # Apply MNIST normalization
-        image_mean = CONFIG['dataset']['mean']
-        image_std = CONFIG['dataset']['std']
-        image_tensor = transforms.Normalize((image_mean,), (image_std,))(image_tensor)
-        # Add batch dimension
-        image_tensor = image_tensor.unsqueeze(0)
-        return image_tensor
+        with METRICS.time_stage('preprocess'):
+            image = np.asarray(image_data, dtype=np.uint8)
+            return preprocess_images(image[np.newaxis])
     except Exception as e:
         import traceback
         print(f"Error processing image: {str(e)}")
         print(traceback.format_exc())
         raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
 
+# Run one forward pass over a batch of images, return class probabilities of shape (N, 10).
+# Uses the currently served model unless a specific LoadedModel is given
+def predict_probabilities(images_tensor, loaded_model=None):
+    if loaded_model is None:
+        loaded_model = load_model()
+    return inference_core.predict_probabilities(images_tensor, loaded_model)
+
+# Quantize a preprocessed image back to uint8 pixels, image_size x image_size per image
+def image_pixels(image_tensor):
+    pixels = np.rint((image_tensor.numpy() + PIXEL_OFFSET) / PIXEL_SCALE)
+    return np.clip(pixels, 0, 255).astype(np.uint8)
+
+# Hash the preprocessed image quantized back to uint8 pixels, so identical and near-identical
+# drawings share a cache key
+def image_cache_key(image_tensor):
+    return hashlib.blake2b(image_pixels(image_tensor).tobytes(), digest_size=16).digest()
+
+# Preprocess one image into the compact form stored with logged predictions: its
+# image_size x image_size uint8 pixels as bytes, 784 for MNIST
+def compact_image(image_data):
+    return image_pixels(process_image(image_data)).tobytes()
+
+# Make predictions for a batch of images with one forward pass, return (digit, confidence, model_version) per image
+def predict_batch(images_tensor):
+    loaded_model = load_model()
+    with METRICS.time_stage('forward'):
+        confidence, prediction = predict_probabilities(images_tensor, loaded_model).max(dim=1)
+    return [(digit, conf, loaded_model.version) for digit, conf in zip(prediction.tolist(), confidence.tolist())]
+
 # Make a prediction with the model
 def predict(image_tensor):
-    model = load_model()
-    device = next(model.parameters()).device
-    image_tensor = image_tensor.to(device)
-    
-    with torch.no_grad():
-        output = model(image_tensor)
-        probabilities = torch.nn.functional.softmax(output, dim=1)
-        prediction = output.argmax(dim=1)
-        confidence = probabilities.max(dim=1)[0]
-    
-    return prediction.item(), confidence.item()
+    return predict_batch(image_tensor)[0]
 
+# Bound the prediction requests being worked on and give each one a deadline. Requests beyond
+# max_in_flight (0 for no bound) are turned away straight away with 503 and Retry-After instead of
+# queueing until their clients time out, and requests whose deadline has passed are dropped before
+# they reach the model. The deadline comes from the X-Request-Timeout-Ms header or the default
+class AdmissionController:
+    def __init__(self, max_in_flight, default_timeout_ms, retry_after_seconds):
+        self.max_in_flight = max_in_flight
+        self.default_timeout = default_timeout_ms / 1000
+        self.retry_after = retry_after_seconds
+        self.in_flight = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.expired_total = 0
 
-# Health check endpoint
-@fastApiApp.get("/health")
-async def health_check():
+    # Admit a request for the duration of the block, with its deadline set in REQUEST_DEADLINE
+    @contextmanager
+    def admit(self, timeout_header):
+        timeout = self.default_timeout
+        if timeout_header is not None:
+            try:
+                timeout = float(timeout_header) / 1000
+            except ValueError:
+                timeout = -1
+            if not timeout > 0:
+                raise HTTPException(status_code=400, detail=f"Invalid X-Request-Timeout-Ms: {timeout_header}")
+        if 0 < self.max_in_flight <= self.in_flight:
+            self.rejected_total += 1
+            raise HTTPException(status_code=503, detail="Server is at capacity",
+                                headers={"Retry-After": str(self.retry_after)})
+        self.in_flight += 1
+        self.admitted_total += 1
+        token = REQUEST_DEADLINE.set(time.monotonic() + timeout)
+        try:
+            yield
+        finally:
+            REQUEST_DEADLINE.reset(token)
+            self.in_flight -= 1
+
+    # Count a request dropped for passing its deadline, return the error to answer it with
+    def expired(self):
+        self.expired_total += 1
+        return HTTPException(status_code=503, detail="Request deadline exceeded",
+                             headers={"Retry-After": str(self.retry_after)})
+
+    def stats(self):
+        return {
+            'max_in_flight': self.max_in_flight,
+            'default_timeout_ms': self.default_timeout * 1000,
+            'in_flight': self.in_flight,
+            'admitted_total': self.admitted_total,
+            'rejected_total': self.rejected_total,
+            'expired_total': self.expired_total
+        }
+
+# Drop the current request if its deadline has passed, so no more work is spent on it.
+# Works on worker threads too, run_blocking carries the deadline along
+def check_deadline():
+    deadline = REQUEST_DEADLINE.get()
+    if deadline is not None and time.monotonic() >= deadline:
+        raise ADMISSION.expired()
+
+
+# Gather concurrent prediction requests into batches and run one forward pass per batch
+class InferenceBatcher:
+    def __init__(self, max_batch_size, max_wait_ms, executor, max_concurrent_batches):
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor
+        self.max_concurrent_batches = max_concurrent_batches
+        self.queue = None
+        self.slots = None
+        self.task = None
+        self.batch_tasks = set()
+        self.requests_total = 0
+        self.batches_total = 0
+        self.batch_size_counts = Counter()
+
+    async def start(self):
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.max_concurrent_batches)
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+        # Let batches already running on the pool finish
+        await asyncio.gather(*self.batch_tasks, return_exceptions=True)
+        while not self.queue.empty():
+            _, future, _ = self.queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Inference batcher stopped"))
+
+    # Queue one image tensor of shape (1, 1, H, W) and wait for its (digit, confidence).
+    # The request's deadline goes along, so it can be dropped if it expires while queued
+    async def submit(self, image_tensor):
+        if self.task is None:
+            return await run_blocking(self.executor, predict, image_tensor)
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((image_tensor, future, REQUEST_DEADLINE.get()))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Wait for a free worker first, so requests arriving meanwhile join the next batch
+            await self.slots.acquire()
+            try:
+                batch = [await self.queue.get()]
+            except asyncio.CancelledError:
+                self.slots.release()
+                raise
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            batch_task = asyncio.create_task(self._process_batch(batch))
+            self.batch_tasks.add(batch_task)
+            batch_task.add_done_callback(self.batch_tasks.discard)
+
+    # Drop requests whose callers gave up (e.g. client disconnected) or whose deadline passed
+    # while they were queued, return the ones still worth scoring
+    def _live_requests(self, batch):
+        now = time.monotonic()
+        live = []
+        for image_tensor, future, deadline in batch:
+            if future.done():
+                continue
+            if deadline is not None and now >= deadline:
+                future.set_exception(ADMISSION.expired())
+            else:
+                live.append((image_tensor, future))
+        return live
+
+    async def _process_batch(self, batch):
+        try:
+            batch = self._live_requests(batch)
+            if not batch:
+                return
+            image_tensors, futures = zip(*batch)
+            try:
+                results = await run_blocking(self.executor, predict_batch, torch.cat(image_tensors))
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for future, result in zip(futures, results):
+                    # Skip callers that gave up while the batch was running
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self.slots.release()
+        self.requests_total += len(batch)
+        self.batches_total += 1
+        self.batch_size_counts[len(batch)] += 1
+
+    def stats(self):
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000,
+            'max_concurrent_batches': self.max_concurrent_batches,
+            'queue_depth': self.queue.qsize() if self.queue is not None else 0,
+            'batches_in_flight': len(self.batch_tasks),
+            'requests_total': self.requests_total,
+            'batches_total': self.batches_total,
+            'mean_batch_size': self.requests_total / self.batches_total if self.batches_total else 0.0,
+            'batch_size_counts': {str(size): count for size, count in sorted(self.batch_size_counts.items())}
+        }
+
+
+# Watch the served model file and swap in new weights once they have loaded, warmed up and passed
+# validation. The swap is a single reference assignment, so requests in flight finish on the old model
+class ModelReloader:
+    def __init__(self, poll_interval_seconds, warmup_batches, executor):
+        self.poll_interval = poll_interval_seconds
+        self.warmup_batches = warmup_batches
+        self.executor = executor
+        self.lock = None
+        self.task = None
+        self.rejected_signature = None
+        self.reloads_total = 0
+        self.failures_total = 0
+        self.last_error = None
+
+    async def start(self):
+        self.lock = asyncio.Lock()
+        if self.poll_interval > 0:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await self.reload()
+            except HTTPException as e:
+                if MODEL is not None:
+                    print(f"Keeping model {MODEL.version}: {e.detail}")
+
+    # Reload the served variant if its file changed since it was loaded (or always when forced),
+    # return the outcome. A file that failed validation is not retried until it changes again.
+    # Without a served model, e.g. after the startup load failed, the configured variant is loaded
+    async def reload(self, force=False):
+        global MODEL
+        async with self.lock:
+            current = MODEL
+            if current is None:
+                return await self._load_initial(force)
+            try:
+                signature = model_file_signature(current.path)
+            except OSError as e:
+                raise HTTPException(status_code=500, detail=f"Model reload error: {str(e)}")
+            if not force and signature in (current.signature, self.rejected_signature):
+                return {'status': 'unchanged', 'model_version': current.version}
+            
+            try:
+                candidate = await run_blocking(self.executor, prepare_model, current.variant, self.warmup_batches)
+            except Exception as e:
+                self.rejected_signature = signature
+                self.failures_total += 1
+                self.last_error = str(e)
+                raise HTTPException(status_code=500, detail=f"Model reload rejected: {str(e)}")
+            
+            if candidate.version == current.version:
+                # Same weights rewritten, nothing to swap
+                current.signature = candidate.signature
+                return {'status': 'unchanged', 'model_version': current.version}
+            MODEL = candidate
+            self.reloads_total += 1
+            print(f"Reloaded {candidate.variant} model {candidate.version} (was {current.version})"
+                  f"{describe_model_accuracy(candidate.variant)}")
+            return {'status': 'reloaded', 'model_version': candidate.version, 'previous_version': current.version}
+
+    # Load the configured variant through load_model, which sets MODEL. Runs on the model loading
+    # thread, so it queues behind a startup load still in progress instead of repeating it
+    async def _load_initial(self, force):
+        path = CONFIG['model']['variant_paths'][CONFIG['model']['variant']]
+        try:
+            signature = model_file_signature(path)
+        except OSError as e:
+            raise HTTPException(status_code=503, detail=f"Model is not loaded: {str(e)}", headers={'Retry-After': '1'})
+        if not force and signature == self.rejected_signature:
+            raise HTTPException(status_code=503, detail=f"Model is not loaded: {self.last_error}",
+                                headers={'Retry-After': '1'})
+        try:
+            candidate = await run_blocking(self.executor, load_model)
+        except HTTPException as e:
+            self.rejected_signature = signature
+            self.failures_total += 1
+            self.last_error = e.detail
+            raise
+        self.reloads_total += 1
+        return {'status': 'loaded', 'model_version': candidate.version}
+
+    def stats(self):
+        current = MODEL
+        return {
+            'model_version': current.version if current is not None else None,
+            'variant': CONFIG['model']['variant'],
+            'path': str(CONFIG['model']['variant_paths'][CONFIG['model']['variant']]),
+            'loaded_at': current.loaded_at.isoformat() if current is not None else None,
+            'poll_interval_seconds': self.poll_interval,
+            'warmup_batches': self.warmup_batches,
+            'reloads_total': self.reloads_total,
+            'failures_total': self.failures_total,
+            'last_error': self.last_error
+        }
+
+
+# LRU cache of (digit, confidence) results with a time to live, emptied whenever the model version changes
+class PredictionCache:
+    def __init__(self, max_entries, ttl_seconds):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()
+        self.model_version = None
+        self.hits_total = 0
+        self.misses_total = 0
+        self.evictions_total = 0
+        self.expirations_total = 0
+        self.invalidations_total = 0
+
+    def _check_model_version(self, model_version):
+        if model_version != self.model_version:
+            if self.entries:
+                self.invalidations_total += 1
+            self.entries.clear()
+            self.model_version = model_version
+
+    def get(self, key, model_version):
+        if self.max_entries <= 0:
+            return None
+        self._check_model_version(model_version)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses_total += 1
+            return None
+        result, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self.entries[key]
+            self.expirations_total += 1
+            self.misses_total += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits_total += 1
+        return result
+
+    def put(self, key, model_version, result):
+        if self.max_entries <= 0:
+            return
+        self._check_model_version(model_version)
+        self.entries[key] = (result, time.monotonic() + self.ttl_seconds)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions_total += 1
+
+    def stats(self):
+        lookups = self.hits_total + self.misses_total
+        return {
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'entries': len(self.entries),
+            'model_version': self.model_version,
+            'hits_total': self.hits_total,
+            'misses_total': self.misses_total,
+            'hit_ratio': self.hits_total / lookups if lookups else 0.0,
+            'evictions_total': self.evictions_total,
+            'expirations_total': self.expirations_total,
+            'invalidations_total': self.invalidations_total
+        }
+
+
+# Buffer logged predictions in memory and write them to the database in multi-row batches
+class PredictionLogWriter:
+    def __init__(self, buffer_size, flush_size, flush_interval_ms, wait_for_commit, put_timeout, executor):
+        self.buffer_size = buffer_size
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.wait_for_commit = wait_for_commit
+        self.put_timeout = put_timeout
+        self.executor = executor
+        self.queue = None
+        self.task = None
+        self.closing = False
+        self.rows_written_total = 0
+        self.flushes_total = 0
+        self.flush_errors_total = 0
+        self.rows_dropped_total = 0
+        self.invalid_rows_total = 0
+        self.rejected_total = 0
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.buffer_size)
+        self.closing = False
+        self.task = asyncio.create_task(self._run())
+
+    # Flush everything still buffered, then stop
+    async def stop(self):
+        if self.task is None:
+            return
+        self.closing = True
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    # Buffer one row, waiting up to put_timeout seconds for space, and for the commit if configured
+    async def submit(self, row):
+        if self.task is None:
+            return await run_blocking(self.executor, insert_predictions, [row])
+        future = asyncio.get_running_loop().create_future() if self.wait_for_commit else None
+        try:
+            await asyncio.wait_for(self.queue.put((row, future)), self.put_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_total += 1
+            raise HTTPException(status_code=503, detail="Prediction log buffer is full", headers={"Retry-After": "1"})
+        if future is not None:
+            await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            entry = await self.queue.get()
+            if entry is None:
+                break
+            batch = [entry]
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            await self._flush(batch)
+
+    async def _flush(self, batch):
+        rows, futures = zip(*batch)
+        while True:
+            try:
+                await run_blocking(self.executor, insert_predictions, rows)
+                break
+            except Exception as e:
+                self.flush_errors_total += 1
+                print(f"Error flushing {len(rows)} logged predictions: {str(e)}")
+                # A row the database rejects fails the same way on every retry, so write the batch
+                # row by row and drop only the rejected rows instead of blocking all logging
+                if getattr(e, 'status_code', None) == 400:
+                    if len(batch) > 1:
+                        for entry in batch:
+                            await self._flush([entry])
+                        return
+                    self.invalid_rows_total += 1
+                    self._fail(futures, e)
+                    return
+                # Callers waiting for the commit are told, otherwise keep retrying until shutdown
+                if self.wait_for_commit or self.closing:
+                    self.rows_dropped_total += len(rows)
+                    self._fail(futures, e)
+                    return
+                await asyncio.sleep(self.flush_interval)
+        for future in futures:
+            if future is not None and not future.done():
+                future.set_result(None)
+        self.rows_written_total += len(rows)
+        self.flushes_total += 1
+
+    def _fail(self, futures, error):
+        for future in futures:
+            if future is not None and not future.done():
+                future.set_exception(error)
+
+    def stats(self):
+        return {
+            'buffer_size': self.buffer_size,
+            'buffered': self.queue.qsize() if self.queue is not None else 0,
+            'flush_size': self.flush_size,
+            'flush_interval_ms': self.flush_interval * 1000,
+            'wait_for_commit': self.wait_for_commit,
+            'rows_written_total': self.rows_written_total,
+            'flushes_total': self.flushes_total,
+            'mean_flush_size': self.rows_written_total / self.flushes_total if self.flushes_total else 0.0,
+            'flush_errors_total': self.flush_errors_total,
+            'rows_dropped_total': self.rows_dropped_total,
+            'invalid_rows_total': self.invalid_rows_total,
+            'rejected_total': self.rejected_total
+        }
+
+
+# Check that the database answers queries
+def check_db_connection():
+    with DB_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+    check_db_schema()
+
+# Check the predictions table has every column logging writes. Postgres only runs init.sql on an
+# empty data volume, so databases created before a column was added need deploy.sh to apply it
+def check_db_schema():
+    with DB_POOL.connection() as conn:
+        with conn.cursor() as cur:
+            try:
+                cur.execute("SELECT id, timestamp, predicted_digit, true_label, confidence, image FROM predictions LIMIT 0")
+            except psycopg2.errors.UndefinedColumn as e:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Database schema is out of date, apply database/init.sql: {str(e).splitlines()[0]}"
+                )
+
+# Version (latest id, window row count) a client last saw, from its If-None-Match header
+def parse_history_etag(if_none_match):
+    match = HISTORY_ETAG_PATTERN.search(if_none_match or '')
+    return (int(match[1]), int(match[2])) if match else None
+
+# Parse a keyset pagination cursor "<timestamp>,<id>" into (timestamp, id), or None
+def parse_history_cursor(before):
+    if before is None:
+        return None
     try:
-        conn = get_db_connection()
-        conn.close()
-        return {"status": "healthy"}
+        timestamp, row_id = before.rsplit(',', 1)
+        return datetime.datetime.fromisoformat(timestamp), int(row_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor, expected '<timestamp>,<id>': {before}")
+
+def format_history_cursor(timestamp, row_id):
+    return f"{timestamp.isoformat()},{row_id}"
+
+# Fetch predictions newest first as (id, timestamp, predicted_digit, true_label, confidence) rows,
+# starting strictly after the (timestamp, id) cursor so each page is an index range scan.
+# since_id keeps only rows with a higher id, for clients fetching what they have not seen yet
+def fetch_prediction_history(limit, cursor=None, predicted_digit=None, true_label=None, since_id=None):
+    conditions, params = [], []
+    if cursor is not None:
+        conditions.append("(timestamp, id) < (%s, %s)")
+        params.extend(cursor)
+    if since_id is not None:
+        conditions.append("id > %s")
+        params.append(since_id)
+    if predicted_digit is not None:
+        conditions.append("predicted_digit = %s")
+        params.append(predicted_digit)
+    if true_label is not None:
+        conditions.append("true_label = %s")
+        params.append(true_label)
+    where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+    try:
+        with DB_POOL.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT id, timestamp, predicted_digit, true_label, confidence FROM predictions "
+                f"{where}ORDER BY timestamp DESC, id DESC LIMIT %s",
+                (*params, limit)
+            )
+            return cur.fetchall()
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching prediction history: {str(e)}")
 
-# Endpoint to get prediction history
-@fastApiApp.get("/prediction-history")
-async def get_prediction_history(limit: int = 10):
-    conn = get_db_connection()
+# Rows among the PREDICTION_HISTORY_OVERLAP_IDS ids up to and including latest_id
+def count_history_window(latest_id):
     try:
-        with conn.cursor() as cur:
+        with DB_POOL.connection() as conn, conn.cursor() as cur:
             cur.execute(
-                "SELECT timestamp, predicted_digit, true_label, confidence FROM predictions ORDER BY timestamp DESC LIMIT %s",
-                (limit,)
+                "SELECT COUNT(*) FROM predictions WHERE id > %s AND id <= %s",
+                (latest_id - CONFIG['prediction_history']['overlap_ids'], latest_id)
             )
-            predictions = cur.fetchall()
-            return [
-                PredictionHistoryResponse(
-                    timestamp=timestamp,
-                    predicted_digit=predicted_digit,
-                    true_label=true_label,
-                    confidence=confidence
-                )
-                for timestamp, predicted_digit, true_label, confidence in predictions
-            ]
+            return cur.fetchone()[0]
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching prediction history: {str(e)}")
-    finally:
-        conn.close()
 
-# Endpoint for digit prediction
-@fastApiApp.post("/predict", response_model=PredictionResponse)
-async def predict_digit(request: PredictionRequest):
+# Version of the history as (latest id, rows among the last PREDICTION_HISTORY_OVERLAP_IDS ids),
+# (0, 0) when there are none. Predictions are only ever inserted, so the latest id changes with
+# every insert committed in id order, and the count with one committed late within the overlap
+def fetch_history_version():
     try:
-        image_tensor = process_image(request.image_data)
-        prediction, confidence = predict(image_tensor)
-        return PredictionResponse(predicted_digit=prediction, confidence=confidence)
+        with DB_POOL.connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT COALESCE(MAX(id), 0), COUNT(*) FROM predictions "
+                "WHERE id > (SELECT COALESCE(MAX(id), 0) FROM predictions) - %s",
+                (CONFIG['prediction_history']['overlap_ids'],)
+            )
+            return cur.fetchone()
+    except HTTPException:
+        raise
     except Exception as e:
-        import traceback
-        print(f"Error in predict_digit: {str(e)}")
-        print(traceback.format_exc())
-        raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error fetching prediction history: {str(e)}")
 
-# Endpoint to log a prediction to the database
-@fastApiApp.post("/log-prediction")
-async def log_prediction(request: PredictionLogRequest):
-    conn = get_db_connection()
+# Combine the hourly analytics buckets overlapping [start, end) into accuracy, per-digit accuracy,
+# a confusion matrix (rows are true labels) and confidence histograms, without touching predictions.
+# Whole buckets are counted, so start is rounded down to the hour and end up to the next one.
+# The summary tables only hold rows with digit labels and predictions, see database/init.sql
+def fetch_prediction_analytics(start, end):
+    conditions, params = [], []
+    if start is not None:
+        conditions.append("bucket_start >= date_trunc('hour', %s::timestamp)")
+        params.append(start)
+    if end is not None:
+        conditions.append("bucket_start < %s::timestamp")
+        params.append(end)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    # Buckets written before the trigger skipped non-digit rows cannot index the matrix
+    confusion_where = ' AND '.join(["true_label BETWEEN 0 AND 9", "predicted_digit BETWEEN 0 AND 9", *conditions])
     try:
-        with conn.cursor() as cur:
+        with DB_POOL.connection() as conn, conn.cursor() as cur:
             cur.execute(
-                "INSERT INTO predictions (predicted_digit, true_label, confidence, timestamp) VALUES (%s, %s, %s, %s)",
-                (request.predicted_digit, request.true_label, request.confidence, datetime.datetime.now())
+                "SELECT true_label, predicted_digit, SUM(count) FROM prediction_confusion_counts "
+                f"WHERE {confusion_where} GROUP BY true_label, predicted_digit",
+                params
+            )
+            confusion_cells = cur.fetchall()
+            cur.execute(
+                f"SELECT correct, bin, SUM(count) FROM prediction_confidence_histogram {where} GROUP BY correct, bin",
+                params
+            )
+            histogram_cells = cur.fetchall()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching prediction analytics: {str(e)}")
+
+    confusion_matrix = np.zeros((10, 10), dtype=np.int64)
+    for true_label, predicted_digit, count in confusion_cells:
+        confusion_matrix[true_label, predicted_digit] = count
+    histogram = np.zeros((2, 10), dtype=np.int64)
+    for correct, histogram_bin, count in histogram_cells:
+        histogram[int(correct), histogram_bin] = count
+
+    per_label = confusion_matrix.sum(axis=1)
+    per_label_correct = confusion_matrix.diagonal()
+    total, correct = int(per_label.sum()), int(per_label_correct.sum())
+    return AccuracyAnalyticsResponse(
+        start=start,
+        end=end,
+        total=total,
+        correct=correct,
+        accuracy=correct / total if total else None,
+        per_digit=[
+            DigitAccuracy(
+                digit=digit,
+                count=int(per_label[digit]),
+                correct=int(per_label_correct[digit]),
+                accuracy=int(per_label_correct[digit]) / int(per_label[digit]) if per_label[digit] else None
+            )
+            for digit in range(10)
+        ],
+        confusion_matrix=confusion_matrix.tolist(),
+        confidence_histogram=ConfidenceHistogram(
+            bin_edges=[round(0.1 * i, 1) for i in range(11)],
+            correct=histogram[1].tolist(),
+            incorrect=histogram[0].tolist()
+        )
+    )
+
+# Insert labelled predictions, (predicted_digit, true_label, confidence, timestamp, image) rows,
+# in one transaction. image is the compact_image bytes or None
+def insert_predictions(rows):
+    try:
+        with DB_POOL.connection() as conn, conn.cursor() as cur:
+            psycopg2.extras.execute_values(
+                cur,
+                "INSERT INTO predictions (predicted_digit, true_label, confidence, timestamp, image) VALUES %s",
+                rows,
+                page_size=len(rows)
             )
             conn.commit()
-        return {"status": "success"}
+    except HTTPException:
+        raise
+    # Rows the database refuses, e.g. values out of range for their column, are not worth retrying
+    except (psycopg2.DataError, psycopg2.IntegrityError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid prediction log row: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error logging prediction: {str(e)}")
+
+# Preprocess a stack of images and score it in chunks to bound peak activation memory,
+# return (probabilities, model_version) with every chunk scored by the same model
+def score_images(images):
+    with METRICS.time_stage('preprocess'):
+        images_tensor = preprocess_images(images)
+    loaded_model = load_model()
+    chunks = []
+    with METRICS.time_stage('forward'):
+        for chunk in images_tensor.split(CONFIG['inference']['max_batch_size']):
+            check_deadline()
+            chunks.append(predict_probabilities(chunk, loaded_model))
+    return torch.cat(chunks), loaded_model.version
+
+
+# Preprocess one image and predict it through the cache and the batcher,
+# return (digit, confidence, model_version)
+async def predict_image(image_data):
+    check_deadline()
+    image_tensor = await run_blocking(INFERENCE_EXECUTOR, process_image, image_data)
+    cache_key, model_version = image_cache_key(image_tensor), require_model().version
+    cached = PREDICTION_CACHE.get(cache_key, model_version)
+    if cached is not None:
+        return (*cached, model_version)
+    check_deadline()
+    # Queue wait plus this request's share of a batched forward pass
+    with METRICS.time_stage('inference'):
+        prediction, confidence, model_version = await BATCHER.submit(image_tensor)
+    PREDICTION_CACHE.put(cache_key, model_version, (prediction, confidence))
+    return prediction, confidence, model_version
+
+
+# Health check endpoint
+@fastApiApp.get("/health")
+async def health_check():
+    try:
+        await run_blocking(DB_EXECUTOR, check_db_connection)
+        return {"status": "healthy"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
+
+# Liveness probe: the process is serving requests and the model has not failed to load.
+# Touches neither the model nor the database, so it answers during startup
+@fastApiApp.get("/health/live")
+async def liveness_check(request: Request):
+    task = getattr(request.app.state, 'model_load_task', None)
+    # A failed startup load stops counting once the reloader has loaded a model since
+    if MODEL is None and task is not None and task.done() and not task.cancelled() and task.exception() is not None:
+        raise HTTPException(status_code=500, detail=getattr(task.exception(), 'detail', str(task.exception())))
+    return {"status": "alive"}
+
+# Readiness probe: the model is loaded and warmed up, so prediction requests will be served
+@fastApiApp.get("/health/ready")
+async def readiness_check():
+    return {"status": "ready", "model_version": require_model().version}
+
+# Endpoint to get prediction history, newest first. Pass the X-Next-Before response header
+# back as `before` to get the next page, or the highest id already held as `since` to get only
+# newer rows. Responses carry an ETag of the history version, and a matching If-None-Match gets an
+# empty 304 without the history being queried. Concurrent inserts can commit out of id order: when
+# the If-None-Match version shows rows committed late within PREDICTION_HISTORY_OVERLAP_IDS ids of
+# its latest id, or there is none, a `since` delta reaches back over that window too, and clients
+# de-duplicate the repeated rows by id
+@fastApiApp.get("/prediction-history", response_model=list[PredictionHistoryResponse])
+async def get_prediction_history(
+    request: Request,
+    response: Response,
+    limit: int = Query(10, ge=1, le=10000),
+    before: str | None = None,
+    since: int | None = None,
+    predicted_digit: int | None = None,
+    true_label: int | None = None
+):
+    cursor = parse_history_cursor(before)
+    latest_id, recent_rows = await run_blocking(DB_EXECUTOR, fetch_history_version)
+    etag = f'W/"history-{latest_id}-{recent_rows}"'
+    if etag in request.headers.get('if-none-match', ''):
+        return Response(status_code=304, headers={'ETag': etag})
+    if since is not None:
+        previous = parse_history_etag(request.headers.get('if-none-match'))
+        if previous is None or await run_blocking(DB_EXECUTOR, count_history_window, previous[0]) != previous[1]:
+            since -= CONFIG['prediction_history']['overlap_ids']
+    rows = await run_blocking(
+        DB_EXECUTOR, fetch_prediction_history, limit, cursor, predicted_digit, true_label, since
+    )
+    response.headers['ETag'] = etag
+    if len(rows) == limit:
+        response.headers['X-Next-Before'] = format_history_cursor(rows[-1][1], rows[-1][0])
+    return [
+        PredictionHistoryResponse(
+            id=row_id,
+            timestamp=timestamp,
+            predicted_digit=predicted_digit,
+            true_label=true_label,
+            confidence=confidence
+        )
+        for row_id, timestamp, predicted_digit, true_label, confidence in rows
+    ]
+
+# Endpoint to stream the full (optionally filtered) prediction history as newline-delimited JSON,
+# fetched page by page so no connection or transaction is held open between pages
+@fastApiApp.get("/prediction-history/export")
+async def export_prediction_history(
+    before: str | None = None,
+    predicted_digit: int | None = None,
+    true_label: int | None = None,
+    page_size: int = Query(5000, ge=1, le=50000)
+):
+    cursor = parse_history_cursor(before)
+
+    async def generate_lines(cursor):
+        while True:
+            rows = await run_blocking(
+                DB_EXECUTOR, fetch_prediction_history, page_size, cursor, predicted_digit, true_label
+            )
+            yield ''.join(
+                json.dumps({
+                    'id': row_id,
+                    'timestamp': timestamp.isoformat(),
+                    'predicted_digit': row_predicted_digit,
+                    'true_label': row_true_label,
+                    'confidence': confidence
+                }) + '\n'
+                for row_id, timestamp, row_predicted_digit, row_true_label, confidence in rows
+            )
+            if len(rows) < page_size:
+                return
+            cursor = (rows[-1][1], rows[-1][0])
+
+    return StreamingResponse(generate_lines(cursor), media_type="application/x-ndjson")
+
+# Endpoint for accuracy analytics over logged predictions, optionally limited to [start, end).
+# Served from hourly summary buckets, so start is rounded down to the hour and end up to the next one
+@fastApiApp.get("/analytics", response_model=AccuracyAnalyticsResponse)
+async def get_prediction_analytics(start: datetime.datetime | None = None, end: datetime.datetime | None = None):
+    return await run_blocking(DB_EXECUTOR, fetch_prediction_analytics, start, end)
+
+# Endpoint for digit prediction, accepts a JSON PredictionRequest or a binary upload
+# (application/octet-stream with X-Image-Shape header, application/x-npy or image/png)
+# Prediction endpoints pass admission control first: requests over ADMISSION_MAX_IN_FLIGHT get 503
+# with Retry-After, and a request still unanswered at its deadline (X-Request-Timeout-Ms header,
+# ADMISSION_DEFAULT_TIMEOUT_MS by default) gets 503 instead of a late answer
+@fastApiApp.post("/predict", response_model=PredictionResponse)
+async def predict_digit(request: Request):
+    require_model()
+    with ADMISSION.admit(request.headers.get('x-request-timeout-ms')):
+        content_type = request.headers.get('content-type', 'application/json').split(';')[0].strip()
+        body = await request.body()
+        try:
+            with METRICS.time_stage('parse'):
+                if content_type == 'application/json':
+                    image_data = PredictionRequest.model_validate_json(body).image_data
+                else:
+                    image_data = decode_image_payload(body, content_type, request.headers.get('x-image-shape'))
+            prediction, confidence, model_version = await predict_image(image_data)
+            return PredictionResponse(predicted_digit=prediction, confidence=confidence, model_version=model_version)
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        except HTTPException:
+            raise
+        except Exception as e:
+            import traceback
+            print(f"Error in predict_digit: {str(e)}")
+            print(traceback.format_exc())
+            raise HTTPException(status_code=500, detail=f"Prediction error: {str(e)}")
+
+# Endpoint for scoring many digits in one round trip, accepts a JSON BatchPredictionRequest of shape
+# (N, H, W, C) or a binary upload of shape (N, H, W) or (N, H, W, C) in the same formats as /predict
+@fastApiApp.post("/predict-batch", response_model=BatchPredictionResponse)
+async def predict_digits_batch(request: Request, top_k: int = Query(0, ge=0, le=10)):
+    require_model()
+    with ADMISSION.admit(request.headers.get('x-request-timeout-ms')):
+        content_type = request.headers.get('content-type', 'application/json').split(';')[0].strip()
+        body = await request.body()
+        try:
+            with METRICS.time_stage('parse'):
+                if content_type == 'application/json':
+                    batch = BatchPredictionRequest.model_validate_json(body)
+                    # Ragged image lists and pixels outside 0-255 cannot become a uint8 array
+                    try:
+                        images = np.asarray(batch.images, dtype=np.uint8)
+                    except (ValueError, OverflowError) as e:
+                        raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
+                else:
+                    images = decode_image_payload(body, content_type, request.headers.get('x-image-shape'))
+                    if content_type == 'image/png':
+                        images = images[np.newaxis]
+            if len(images) > CONFIG['inference']['max_request_images']:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Too many images: {len(images)} (limit {CONFIG['inference']['max_request_images']})"
+                )
+            check_deadline()
+            try:
+                probabilities, model_version = await run_blocking(INFERENCE_EXECUTOR, score_images, images)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=f"Image processing error: {str(e)}")
+            confidences, predictions = probabilities.max(dim=1)
+            if top_k:
+                top_probabilities, top_digits = probabilities.topk(top_k, dim=1)
+                top_k_lists = [
+                    [DigitProbability(digit=digit, probability=probability) for digit, probability in zip(digits, probs)]
+                    for digits, probs in zip(top_digits.tolist(), top_probabilities.tolist())
+                ]
+            else:
+                top_k_lists = [None] * len(images)
+            return BatchPredictionResponse(model_version=model_version, predictions=[
+                BatchPredictionItem(predicted_digit=prediction, confidence=confidence, top_k=top_k_list)
+                for prediction, confidence, top_k_list in zip(predictions.tolist(), confidences.tolist(), top_k_lists)
+            ])
+        except ValidationError as e:
+            raise RequestValidationError(e.errors())
+        except HTTPException:
+            raise
+        except Exception as e:
+            import traceback
+            print(f"Error in predict_digits_batch: {str(e)}")
+            print(traceback.format_exc())
+            raise HTTPException(status_code=500, detail=f"Batch prediction error: {str(e)}")
+
+# Streaming prediction channel for live recognition while the user draws. The client sends binary
+# frames of raw uint8 pixels, shaped by the `shape` query parameter (default image_size x image_size),
+# and gets a JSON prediction back per scored frame, numbered by the frame's position on the connection.
+# Frames arriving while one is being scored replace each other, so only the latest one gets scored
+@fastApiApp.websocket("/predict/stream")
+async def predict_stream(websocket: WebSocket, shape: str | None = None):
+    image_size = CONFIG['dataset']['image_size']
+    image_shape = shape or f"{image_size},{image_size}"
+    await websocket.accept()
+    if MODEL is None:
+        # 1013: try again later
+        await websocket.close(code=1013, reason="Model is still loading")
+        return
+
+    latest = None
+    frames_received = 0
+    frames_dropped = 0
+    frame_ready = asyncio.Event()
+    # The receive loop and the scorer both reply, one whole message at a time
+    send_lock = asyncio.Lock()
+
+    async def send(message):
+        async with send_lock:
+            await websocket.send_json(message)
+
+    async def score_latest_frames():
+        nonlocal latest
+        while True:
+            await frame_ready.wait()
+            frame_ready.clear()
+            frame, image_data = latest
+            try:
+                prediction, confidence, model_version = await predict_image(image_data)
+                message = {
+                    'frame': frame,
+                    'predicted_digit': prediction,
+                    'confidence': confidence,
+                    'model_version': model_version,
+                    'frames_dropped': frames_dropped
+                }
+            except HTTPException as e:
+                message = {'frame': frame, 'error': e.detail}
+            except Exception as e:
+                message = {'frame': frame, 'error': f"Prediction error: {str(e)}"}
+            await send(message)
+
+    scorer = asyncio.create_task(score_latest_frames())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            frames_received += 1
+            if message.get('bytes') is None:
+                await send({'frame': frames_received, 'error': "Frames must be binary uint8 pixels"})
+                continue
+            try:
+                image_data = decode_image_payload(message['bytes'], 'application/octet-stream', image_shape)
+            except HTTPException as e:
+                await send({'frame': frames_received, 'error': e.detail})
+                continue
+            if frame_ready.is_set():
+                frames_dropped += 1
+            latest = (frames_received, image_data)
+            frame_ready.set()
+    except WebSocketDisconnect:
+        pass
     finally:
-        conn.close()
+        scorer.cancel()
+
+# Endpoint to inspect achieved inference batch sizes
+@fastApiApp.get("/inference-stats")
+async def get_inference_stats():
+    return BATCHER.stats()
+
+# Endpoint to inspect admission control: requests in flight and how many were shed
+@fastApiApp.get("/admission-stats")
+async def get_admission_stats():
+    return ADMISSION.stats()
+
+# Endpoint to inspect database connection pool saturation
+@fastApiApp.get("/db-pool-stats")
+async def get_db_pool_stats():
+    return DB_POOL.stats()
+
+# Endpoint to inspect prediction cache effectiveness
+@fastApiApp.get("/prediction-cache-stats")
+async def get_prediction_cache_stats():
+    return PREDICTION_CACHE.stats()
+
+# Admin endpoint to reload the served model from disk now, instead of waiting for the watcher.
+# With force, the file is reloaded even if it looks unchanged
+@fastApiApp.post("/admin/reload-model")
+async def reload_model(force: bool = False):
+    return await MODEL_RELOADER.reload(force)
+
+# Endpoint to inspect the served model version and reload history
+@fastApiApp.get("/model-stats")
+async def get_model_stats():
+    return MODEL_RELOADER.stats()
+
+# Prometheus scrape endpoint: request, stage timing and component metrics in the text exposition format
+@fastApiApp.get("/metrics")
+async def get_metrics():
+    components = {
+        'admission': ADMISSION.stats(),
+        'inference': BATCHER.stats(),
+        'prediction_cache': PREDICTION_CACHE.stats(),
+        'db_pool': DB_POOL.stats(),
+        'prediction_log': LOG_WRITER.stats(),
+        'model': MODEL_RELOADER.stats(),
+    }
+    return Response(METRICS.render(components), media_type="text/plain; version=0.0.4")
+
+# Endpoint to log a prediction to the database, with the image it was made for when given,
+# so labelled drawings can be used to fine-tune the model
+@fastApiApp.post("/log-prediction")
+async def log_prediction(request: PredictionLogRequest):
+    image = None
+    if request.image_data is not None:
+        image = await run_blocking(INFERENCE_EXECUTOR, compact_image, request.image_data)
+    await LOG_WRITER.submit(
+        (request.predicted_digit, request.true_label, request.confidence, datetime.datetime.now(), image)
+    )
+    return {"status": "success"}
+
+# Endpoint to inspect the prediction log write-behind buffer
+@fastApiApp.get("/log-writer-stats")
+async def get_log_writer_stats():
+    return LOG_WRITER.stats()
 
 
 ENV_VARS = {
@@ -225,19 +1682,95 @@ ENV_VARS = {
     'DB_USER': None,
     'DB_PASSWORD': None,
     'DB_TIMEOUT': None,
-    'CONTAINER_WORKDIR_NAME': None,
-    'TRAINED_MODEL_DIR_NAME': None,
-    'TRAINED_MODEL_NAME': None,
     'MODEL_FILE_NAME': None,
-    'MNIST_DATASET_IMAGE_SIZE': None,
-    'MNIST_DATASET_MEAN': None,
-    'MNIST_DATASET_STD': None,
     'WEBSERVER_PORT': None,
+    'INFERENCE_MAX_BATCH_SIZE': None,
+    'INFERENCE_MAX_WAIT_MS': None,
+    'INFERENCE_MAX_REQUEST_IMAGES': None,
+    'INFERENCE_WORKERS': None,
+    'INFERENCE_TORCH_THREADS': None,
+    'INFERENCE_TORCH_INTEROP_THREADS': None,
+    'DB_WORKERS': None,
+    'DB_POOL_MIN_SIZE': None,
+    'DB_POOL_MAX_SIZE': None,
+    'DB_POOL_VALIDATE_IDLE_SECONDS': None,
+    'PREDICTION_LOG_BUFFER_SIZE': None,
+    'PREDICTION_LOG_FLUSH_SIZE': None,
+    'PREDICTION_LOG_FLUSH_INTERVAL_MS': None,
+    'PREDICTION_LOG_WAIT_FOR_COMMIT': None,
+    'PREDICTION_HISTORY_OVERLAP_IDS': None,
+    'PREDICTION_CACHE_MAX_ENTRIES': None,
+    'PREDICTION_CACHE_TTL_SECONDS': None,
+    'ADMISSION_MAX_IN_FLIGHT': None,
+    'ADMISSION_DEFAULT_TIMEOUT_MS': None,
+    'ADMISSION_RETRY_AFTER_SECONDS': None,
+    'MODEL_VARIANT': None,
+    'MODEL_RELOAD_POLL_SECONDS': None,
+    'MODEL_WARMUP_BATCHES': None,
+    'MODEL_BACKGROUND_LOAD': None,
+    'METRICS_ENABLED': None,
+    'METRICS_TIMING_HEADERS': None,
 }
 CONFIG = load_environment_variables()
 
+# Stage timings of the request being handled, None outside requests
+REQUEST_TIMINGS = contextvars.ContextVar('request_timings', default=None)
+# time.monotonic() deadline of the prediction request being handled, None outside them
+REQUEST_DEADLINE = contextvars.ContextVar('request_deadline', default=None)
+METRICS = Metrics(CONFIG['metrics']['enabled'], CONFIG['metrics']['timing_headers'])
+if METRICS.enabled:
+    fastApiApp.add_middleware(MetricsMiddleware, metrics=METRICS)
+
+torch = None
+# The model is loaded by the lifespan (or the first load_model() call), not at import
 MODEL = None
-MODEL = load_model()
+MODEL_LOAD_LOCK = threading.Lock()
+HISTORY_ETAG_PATTERN = re.compile(r'W/"history-(\d+)-(\d+)"')
+PREDICTION_CACHE = PredictionCache(
+    CONFIG['prediction_cache']['max_entries'],
+    CONFIG['prediction_cache']['ttl_seconds']
+)
+
+# Model work and database work get separate pools so a slow database cannot starve inference
+INFERENCE_EXECUTOR = create_executor(
+    CONFIG['inference']['workers'], 'inference',
+    initializer=init_torch_thread, initargs=(CONFIG['inference']['torch_threads'],)
+)
+DB_EXECUTOR = create_executor(CONFIG['db']['workers'], 'db')
+DB_POOL = DatabasePool(CONFIG['db'])
+LOG_WRITER = PredictionLogWriter(
+    CONFIG['prediction_log']['buffer_size'],
+    CONFIG['prediction_log']['flush_size'],
+    CONFIG['prediction_log']['flush_interval_ms'],
+    CONFIG['prediction_log']['wait_for_commit'],
+    CONFIG['db']['timeout'],
+    DB_EXECUTOR
+)
+
+ADMISSION = AdmissionController(
+    CONFIG['admission']['max_in_flight'],
+    CONFIG['admission']['default_timeout_ms'],
+    CONFIG['admission']['retry_after_seconds']
+)
+
+BATCHER = InferenceBatcher(
+    CONFIG['inference']['max_batch_size'],
+    CONFIG['inference']['max_wait_ms'],
+    INFERENCE_EXECUTOR,
+    max(CONFIG['inference']['workers'], 1)
+)
+
+# The startup model and reload candidates load and warm up on their own thread,
+# leaving the inference pool to live traffic
+MODEL_LOAD_EXECUTOR = create_executor(
+    1, 'model-load',
+    initializer=init_torch_thread, initargs=(CONFIG['inference']['torch_threads'],)
+)
+MODEL_RELOADER = ModelReloader(
+    CONFIG['model_reload']['poll_seconds'],
+    CONFIG['model']['warmup_batches'],
+    MODEL_LOAD_EXECUTOR
+)
 
 if __name__ == "__main__":
     port = int(ENV_VARS['WEBSERVER_PORT'])